@@ -0,0 +1,130 @@
+"""
+Инкрементальная агрегация посуточного времени кодинга по скользящим окнам.
+
+Для каждого пользователя хранятся посуточные значения и префиксные суммы,
+поэтому сумма за любое окно (7/30/90/365 дней или произвольный диапазон)
+считается за O(1). Изменение последних дней обновляет только хвост
+префиксных сумм, а день, выпавший из окна, просто перестаёт в него попадать.
+Значения хранятся в array('d') — по 8 байт на день вместо объекта float
+и ссылки в списке, что заметно для долгоживущего агрегатора в памяти процесса.
+"""
+from array import array
+from datetime import date, timedelta
+
+
+class UserSeries:
+    """
+    Посуточный ряд одного пользователя с префиксными суммами.
+
+    prefix[i] — сумма секунд за дни base .. base + i - 1.
+    """
+
+    def __init__(self, base: date):
+        self.base = base
+        self.values = array("d")
+        self.prefix = array("d", [0.0])
+
+    @property
+    def last_day(self) -> date:
+        return self.base + timedelta(days=len(self.values) - 1) if self.values else None
+
+    def set_day(self, day: date, seconds: float):
+        """Записывает итог дня; префиксные суммы обновляются только начиная с этого дня."""
+        index = (day - self.base).days
+        if index < 0:
+            return
+        if index >= len(self.values):
+            # Недостающие дни до нового считаются нулевыми
+            last = self.prefix[-1]
+            missing = index - len(self.values)
+            self.values.extend([0.0] * missing)
+            self.prefix.extend([last] * missing)
+            self.values.append(float(seconds))
+            self.prefix.append(last + seconds)
+            return
+
+        delta = seconds - self.values[index]
+        if not delta:
+            return
+        self.values[index] = float(seconds)
+        # Обычно меняются сегодня и вчера, поэтому хвост короткий
+        for i in range(index + 1, len(self.prefix)):
+            self.prefix[i] += delta
+
+    def window_sum(self, start: date, end: date) -> float:
+        """Сумма секунд за дни start..end включительно за O(1)."""
+        lo = max(0, (start - self.base).days)
+        hi = min(len(self.values), (end - self.base).days + 1)
+        if hi <= lo:
+            return 0.0
+        return self.prefix[hi] - self.prefix[lo]
+
+    def trim(self, new_base: date):
+        """Отбрасывает дни раньше new_base."""
+        shift = (new_base - self.base).days
+        if shift <= 0:
+            return
+        shift = min(shift, len(self.values))
+        offset = self.prefix[shift]
+        self.values = self.values[shift:]
+        self.prefix = array("d", (value - offset for value in self.prefix[shift:]))
+        self.base = new_base
+
+
+class RollingAggregator:
+    """
+    Скользящие итоги по всем пользователям.
+
+    История ограничена history_days последними днями. Старые дни
+    отбрасываются пакетно, когда накопится ещё столько же, так что
+    сдвиг окна обходится в амортизированное O(1) на день.
+    """
+
+    def __init__(self, history_days: int):
+        self.history_days = history_days
+        self.users = {}
+
+    def _history_start(self, today: date) -> date:
+        return today - timedelta(days=self.history_days - 1)
+
+    def set_day(self, telegram_id: int, day: date, seconds: float, today: date = None):
+        today = today or date.today()
+        history_start = self._history_start(today)
+        if day < history_start:
+            return
+        series = self.users.get(telegram_id)
+        if series is None:
+            series = self.users[telegram_id] = UserSeries(history_start)
+        elif (history_start - series.base).days >= self.history_days:
+            series.trim(history_start)
+        series.set_day(day, seconds)
+
+    def update(self, telegram_id: int, days, today: date = None):
+        """Применяет ряд [(день, секунды), ...] пользователя."""
+        for day, seconds in days:
+            self.set_day(telegram_id, day, seconds, today)
+
+    def window_minutes(self, telegram_id: int, start: date, end: date) -> float:
+        """Время кодинга пользователя (в минутах) за дни start..end включительно."""
+        series = self.users.get(telegram_id)
+        if series is None:
+            return 0.0
+        return series.window_sum(start, end) / 60.0
+
+    def entries(self, users, start: date, end: date):
+        """
+        Возвращает список кортежей (telegram_id, username, minutes) за диапазон дат
+        для пользователей с ключом.
+        """
+        return [
+            (tg_id, username, self.window_minutes(tg_id, start, end))
+            for tg_id, username, waka_key in users
+            if waka_key
+        ]
+
+    def leaderboard(self, users, start: date, end: date):
+        """
+        Возвращает список кортежей (username, minutes) за диапазон дат
+        для пользователей с ключом.
+        """
+        return [(username, minutes) for _, username, minutes in self.entries(users, start, end)]
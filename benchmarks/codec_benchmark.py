@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Сравнение кодеков кэша посуточных рядов: размер записи и время кодирования/декодирования
+относительно прежнего JSON-формата.
+
+Запуск:
+    python -m benchmarks.codec_benchmark --days 1 2 7 30
+"""
+import argparse
+import random
+import time
+from datetime import date, timedelta
+
+from cache_codec import decode_series, encode_series, msgpack
+
+
+def make_series(days):
+    rnd = random.Random(days)
+    end = date.today()
+    return [(end - timedelta(days=days - 1 - i), rnd.uniform(0, 36000)) for i in range(days)]
+
+
+def measure(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--days", type=int, nargs="+", default=[1, 2, 7, 30])
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    codecs = ["json", "binary"] + (["msgpack"] if msgpack is not None else [])
+    written_at = time.time()
+
+    print(f"{'days':>5} {'codec':>8} {'bytes':>7} {'vs json':>8} {'encode, мкс':>12} {'decode, мкс':>12}")
+    for days in args.days:
+        series = make_series(days)
+        json_size = None
+        for codec in codecs:
+            payload = encode_series(written_at, series, codec)
+            json_size = json_size or len(payload)
+            encode_time = measure(lambda: encode_series(written_at, series, codec), args.repeat)
+            decode_time = measure(lambda: decode_series(payload), args.repeat)
+            print(
+                f"{days:>5} {codec:>8} {len(payload):>7} {len(payload) / json_size:>8.2f} "
+                f"{encode_time * 1e6:>12.2f} {decode_time * 1e6:>12.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
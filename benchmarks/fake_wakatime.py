@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Локальная заглушка WakaTime API для бенчмарков.
+
+Отдаёт /api/v1/users/current/summaries и /api/v1/users/current/status_bar/today
+в формате WakaTime с настраиваемой задержкой, долей ошибок 5xx, сериями 429
+и объёмом детализации по дням (проекты, языки, редакторы, ОС, машины),
+а также /api/v1/users/current для проверки ключа.
+
+Служебные маршруты:
+    GET  /__stats  — счётчики запросов по статусам и отданные байты
+    POST /__reset  — сброс счётчиков
+
+Запуск:
+    python -m benchmarks.fake_wakatime --port 8765 --latency 0.05 --error-rate 0.01
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+from aiohttp import web
+
+PROJECTS = ["backend", "frontend", "bot", "infra", "ml-pipeline", "docs", "mobile", "cli"]
+LANGUAGES = ["Python", "TypeScript", "Go", "SQL", "YAML", "Markdown", "Bash", "Rust", "JSON", "HTML"]
+EDITORS = ["VS Code", "PyCharm", "Vim", "Neovim"]
+SYSTEMS = ["Linux", "Mac", "Windows"]
+CATEGORIES = ["Coding", "Debugging", "Building", "Code Reviewing"]
+
+
+class FakeWakaTimeOptions:
+    """
+    Параметры поведения заглушки.
+
+    Args:
+        latency: Средняя задержка ответа в секундах
+        latency_jitter: Случайный разброс задержки в секундах
+        error_rate: Доля ответов 500
+        burst_every: Каждые burst_every запросов начинается серия 429 (0 — без серий)
+        burst_length: Длина серии 429 в запросах
+        retry_after: Значение заголовка Retry-After для 429
+        detail: Количество записей в каждой детализации дня (проекты, языки и т.д.)
+    """
+
+    def __init__(self, latency=0.05, latency_jitter=0.02, error_rate=0.0, burst_every=0,
+                 burst_length=0, retry_after=1, detail=5):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.burst_every = burst_every
+        self.burst_length = burst_length
+        self.retry_after = retry_after
+        self.detail = detail
+
+
+def _duration(seconds):
+    hours, rem = divmod(int(seconds), 3600)
+    minutes, secs = divmod(rem, 60)
+    return {
+        "digital": f"{hours}:{minutes:02d}:{secs:02d}",
+        "hours": hours,
+        "minutes": minutes,
+        "seconds": secs,
+        "text": f"{hours} hrs {minutes} mins",
+        "total_seconds": float(seconds),
+    }
+
+
+def _breakdown(names, total, rnd, count):
+    chosen = rnd.sample(names, min(count, len(names)))
+    weights = [rnd.random() for _ in chosen]
+    weight_sum = sum(weights) or 1.0
+    items = []
+    for name, weight in zip(chosen, weights):
+        seconds = total * weight / weight_sum
+        item = {"name": name, "percent": round(100 * weight / weight_sum, 2)}
+        item.update(_duration(seconds))
+        items.append(item)
+    return items
+
+
+def make_day(api_key, day, detail):
+    """Детерминированные данные одного дня для ключа: одинаковые при повторных запросах."""
+    seed = int(hashlib.sha1(f"{api_key}:{day.isoformat()}".encode()).hexdigest()[:12], 16)
+    rnd = random.Random(seed)
+    total = 0.0 if rnd.random() < 0.2 else rnd.uniform(600, 8 * 3600)
+    start = datetime(day.year, day.month, day.day)
+    return {
+        "grand_total": _duration(total),
+        "range": {
+            "date": day.isoformat(),
+            "start": start.isoformat() + "Z",
+            "end": (start + timedelta(days=1) - timedelta(seconds=1)).isoformat() + "Z",
+            "text": day.strftime("%a %b %d"),
+            "timezone": "UTC",
+        },
+        "projects": _breakdown(PROJECTS, total, rnd, detail),
+        "languages": _breakdown(LANGUAGES, total, rnd, detail),
+        "editors": _breakdown(EDITORS, total, rnd, min(detail, 2)),
+        "operating_systems": _breakdown(SYSTEMS, total, rnd, 1),
+        "categories": _breakdown(CATEGORIES, total, rnd, min(detail, 2)),
+        "machines": [dict(_duration(total), name="workstation", machine_name_id=f"{seed:x}")],
+        "dependencies": [],
+    }
+
+
+class FakeWakaTime:
+    """Состояние заглушки: параметры, генератор случайных ошибок и счётчики."""
+
+    def __init__(self, options: FakeWakaTimeOptions, seed=0):
+        self.options = options
+        self.rnd = random.Random(seed)
+        self.requests = 0
+        self.statuses = Counter()
+        self.bytes_sent = 0
+
+    def _in_burst(self):
+        o = self.options
+        return o.burst_every > 0 and (self.requests % o.burst_every) < o.burst_length
+
+    async def _fail(self, request):
+        """Задержка ответа и общие ошибки всех маршрутов API: ответ с ошибкой или None."""
+        o = self.options
+        self.requests += 1
+        await asyncio.sleep(max(0.0, o.latency + self.rnd.uniform(-o.latency_jitter, o.latency_jitter)))
+
+        if not request.query.get("api_key"):
+            return self._reply(401, {"error": "Unauthorized"})
+        if self._in_burst():
+            return self._reply(429, {"error": "Rate limited"}, {"Retry-After": str(o.retry_after)})
+        if self.rnd.random() < o.error_rate:
+            return self._reply(500, {"error": "Internal Server Error"})
+        return None
+
+    async def summaries(self, request):
+        error = await self._fail(request)
+        if error is not None:
+            return error
+        o = self.options
+        api_key = request.query["api_key"]
+
+        try:
+            start = datetime.strptime(request.query["start"], "%Y-%m-%d").date()
+            end = datetime.strptime(request.query["end"], "%Y-%m-%d").date()
+        except (KeyError, ValueError):
+            return self._reply(400, {"error": "start and end are required"})
+
+        days = [make_day(api_key, start + timedelta(days=i), o.detail) for i in range((end - start).days + 1)]
+        return self._reply(200, {
+            "data": days,
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "cumulative_total": _duration(sum(d["grand_total"]["total_seconds"] for d in days)),
+        })
+
+    async def status_bar_today(self, request):
+        error = await self._fail(request)
+        if error is not None:
+            return error
+        # Как у WakaTime: детализация одного дня без итогов по диапазону
+        return self._reply(200, {"data": make_day(request.query["api_key"], date.today(), self.options.detail)})
+
+    async def current_user(self, request):
+        error = await self._fail(request)
+        if error is not None:
+            return error
+        user_id = hashlib.sha1(request.query["api_key"].encode()).hexdigest()[:16]
+        return self._reply(200, {"data": {"id": user_id, "username": f"user_{user_id[:8]}"}})
+
+    def _reply(self, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.statuses[status] += 1
+        self.bytes_sent += len(body)
+        return web.Response(status=status, body=body, content_type="application/json", headers=headers)
+
+    async def stats(self, request):
+        return web.json_response({
+            "requests": self.requests,
+            "statuses": {str(k): v for k, v in self.statuses.items()},
+            "bytes_sent": self.bytes_sent,
+        })
+
+    async def reset(self, request):
+        self.requests = 0
+        self.statuses.clear()
+        self.bytes_sent = 0
+        return web.json_response({"ok": True})
+
+
+def create_app(options: FakeWakaTimeOptions, seed=0) -> web.Application:
+    fake = FakeWakaTime(options, seed)
+    app = web.Application()
+    app["fake"] = fake
+    app.router.add_get("/api/v1/users/current/summaries", fake.summaries)
+    app.router.add_get("/api/v1/users/current/status_bar/today", fake.status_bar_today)
+    app.router.add_get("/api/v1/users/current", fake.current_user)
+    app.router.add_get("/__stats", fake.stats)
+    app.router.add_post("/__reset", fake.reset)
+    return app
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Заглушка WakaTime API для бенчмарков")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--latency-jitter", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--burst-every", type=int, default=0)
+    parser.add_argument("--burst-length", type=int, default=0)
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--detail", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    options = FakeWakaTimeOptions(
+        latency=args.latency,
+        latency_jitter=args.latency_jitter,
+        error_rate=args.error_rate,
+        burst_every=args.burst_every,
+        burst_length=args.burst_length,
+        retry_after=args.retry_after,
+        detail=args.detail,
+    )
+    web.run_app(create_app(options, args.seed), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Сравнение способов получения и разбора ответов WakaTime против локальной заглушки.
+
+По умолчанию — итог за сегодня для каждой стратегии из wakatime_client.TODAY_STRATEGIES:
+размер ответа, время разбора JSON и полное время запроса.
+
+С --memory — годовые ответы /summaries с полным разбором (json/orjson) и потоковым
+(ijson): пик памяти Python на один запрос (tracemalloc) и прирост пикового RSS
+процесса при --concurrency одновременных запросах. Каждый режим измеряется
+в отдельном процессе, чтобы пиковый RSS одного не влиял на другой.
+
+Запуск:
+    python -m benchmarks.payload_benchmark --users 100 --detail 5
+    python -m benchmarks.payload_benchmark --memory --users 200 --concurrency 50 --detail 10
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+from benchmarks.run_benchmarks import free_port, make_users, percentile, start_fake_server
+
+
+def measure(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+async def fetch_bodies(session, url, params_list):
+    bodies = []
+    for params in params_list:
+        async with session.get(url, params=params) as resp:
+            resp.raise_for_status()
+            bodies.append(await resp.read())
+    return bodies
+
+
+async def run(args):
+    import aiohttp
+    import wakatime_client as wc
+
+    today = date.today()
+    keys = [waka_key for _, _, waka_key in make_users(args.users)]
+    # Адрес, параметры и разбор сырого ответа для каждой стратегии
+    strategies = {
+        "summaries": (
+            wc.SUMMARIES_URL,
+            lambda key: {"api_key": key, "start": today.isoformat(), "end": today.isoformat()},
+            lambda body: wc.parse_summaries(json.loads(body), today),
+        ),
+        "status_bar": (
+            wc.STATUS_BAR_TODAY_URL,
+            lambda key: {"api_key": key},
+            lambda body: wc.parse_status_bar(json.loads(body), today),
+        ),
+    }
+
+    await wc.init_wakatime_client()
+    print(f"{'strategy':>12} {'bytes/resp':>11} {'parse, мкс':>11} {'call p50, с':>12} {'call p99, с':>12}")
+    try:
+        async with aiohttp.ClientSession() as session:
+            for name, (url, make_params, parse) in strategies.items():
+                bodies = await fetch_bodies(session, url, [make_params(key) for key in keys])
+                parse_all = lambda: [parse(body) for body in bodies]
+                parse_time = measure(parse_all, args.repeat) / len(bodies)
+
+                latencies = []
+                for key in keys:
+                    started = time.perf_counter()
+                    await wc.request_today(key, today, strategy=name)
+                    latencies.append(time.perf_counter() - started)
+
+                size = sum(len(body) for body in bodies) / len(bodies)
+                print(
+                    f"{name:>12} {size:>11.0f} {parse_time * 1e6:>11.1f} "
+                    f"{percentile(latencies, 50):>12.4f} {percentile(latencies, 99):>12.4f}",
+                    flush=True,
+                )
+    finally:
+        await wc.close_wakatime_client()
+
+
+def max_rss_mb():
+    # ru_maxrss в Linux — в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def run_memory_child(args):
+    """Замеры памяти одного режима разбора; результат печатается строкой JSON."""
+    import summaries_stream
+    import wakatime_client as wc
+
+    if args.memory_child == "stream" and summaries_stream.ijson is None:
+        sys.exit("Потоковый разбор недоступен: не установлен ijson")
+
+    end = date.today()
+    start = end - timedelta(days=364)
+    keys = [waka_key for _, _, waka_key in make_users(args.users)]
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def fetch(key):
+        async with semaphore:
+            return await wc._request_daily_totals(key, start, end, "year")
+
+    await wc.init_wakatime_client()
+    try:
+        # Одновременные запросы, как в задаче обновления кэша: прирост пикового RSS
+        baseline = max_rss_mb()
+        started = time.perf_counter()
+        await asyncio.gather(*(fetch(key) for key in keys))
+        wall = time.perf_counter() - started
+        rss_growth = max_rss_mb() - baseline
+
+        # Последовательные запросы: пик памяти Python на один запрос
+        tracemalloc.start()
+        peaks = []
+        for key in keys[:args.sample]:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            await fetch(key)
+            peaks.append(tracemalloc.get_traced_memory()[1] - before)
+        tracemalloc.stop()
+    finally:
+        await wc.close_wakatime_client()
+
+    backend = "ijson/" + summaries_stream.ijson.backend if args.memory_child == "stream" else (
+        "orjson" if summaries_stream.orjson is not None else "json"
+    )
+    print(json.dumps({
+        "mode": args.memory_child,
+        "backend": backend,
+        "wall": wall,
+        "rss_growth_mb": rss_growth,
+        "peak_p50_kb": percentile(peaks, 50) / 1024,
+        "peak_max_kb": max(peaks) / 1024 if peaks else 0.0,
+    }))
+
+
+def run_memory(args):
+    print(
+        f"{'mode':>8} {'backend':>16} {'wall, с':>8} {'RSS +MB':>8} "
+        f"{'peak/fetch p50, КБ':>19} {'max, КБ':>9}"
+    )
+    for mode in ("full", "stream"):
+        env = dict(os.environ, WAKATIME_STREAM_PARSE="1" if mode == "stream" else "0")
+        cmd = [
+            sys.executable, "-m", "benchmarks.payload_benchmark", "--memory-child", mode,
+            "--users", str(args.users), "--concurrency", str(args.concurrency), "--sample", str(args.sample),
+        ]
+        result = subprocess.run(cmd, env=env, capture_output=True, text=True)
+        if result.returncode != 0:
+            print(f"{mode:>8}  ошибка: {result.stderr.strip().splitlines()[-1]}", flush=True)
+            continue
+        row = json.loads(result.stdout.strip().splitlines()[-1])
+        print(
+            f"{row['mode']:>8} {row['backend']:>16} {row['wall']:>8.2f} {row['rss_growth_mb']:>8.1f} "
+            f"{row['peak_p50_kb']:>19.1f} {row['peak_max_kb']:>9.1f}",
+            flush=True,
+        )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Размер, разбор и память ответов WakaTime")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=20, help="Повторов разбора, берётся лучший")
+    parser.add_argument("--latency", type=float, default=0.0, help="Средняя задержка заглушки, сек")
+    parser.add_argument("--detail", type=int, default=5, help="Записей в каждой детализации дня")
+    parser.add_argument("--memory", action="store_true",
+                        help="Сравнить память полного и потокового разбора годовых ответов")
+    parser.add_argument("--concurrency", type=int, default=50, help="Одновременных запросов в --memory")
+    parser.add_argument("--sample", type=int, default=20, help="Запросов для замера пика памяти на запрос")
+    parser.add_argument("--memory-child", choices=["full", "stream"], help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.memory_child:
+        # Дочерний процесс замера памяти: заглушка и окружение уже подготовлены родителем
+        logging.basicConfig(level=logging.WARNING)
+        asyncio.run(run_memory_child(args))
+        return
+
+    # Параметры заглушки, которые ожидает start_fake_server
+    args.error_rate, args.burst_every, args.burst_length = 0.0, 0, 0
+    port = free_port()
+
+    # Конфигурация читается при импорте модулей бота, поэтому задаём её заранее
+    os.environ["WAKATIME_API_URL"] = f"http://127.0.0.1:{port}/api/v1"
+    os.environ["RESULT_CACHE_ENABLED"] = "0"
+    for name in ("WAKATIME_RATE", "WAKATIME_BURST", "WAKATIME_KEY_RATE", "WAKATIME_KEY_BURST"):
+        os.environ[name] = "1000000"
+    logging.basicConfig(level=logging.WARNING)
+
+    process = start_fake_server(args, port)
+    try:
+        if args.memory:
+            run_memory(args)
+        else:
+            asyncio.run(run(args))
+    finally:
+        process.terminate()
+        process.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк сбора лидербордов против локальной заглушки WakaTime.
+
+Без БД для каждого числа пользователей запускаются сценарии fetch_day ..
+fetch_year: только параллельные запросы рядов к API (fetch_period_series),
+без загрузки в daily_totals и агрегатора, — это не путь обработчиков.
+
+С --database-url добавляются сквозные сценарии day .. year тем же путём,
+что и в обработчиках (/day — итог за сегодня по каждому пользователю,
+/week .. /year — daily_totals.build_leaderboard: план загрузки, кэш рядов,
+daily_totals и агрегатор), а также скрипты обновления кэша по отдельности
+и общее обновление update_caches. Первый прогон сквозного сценария
+загружает историю целиком, следующие — только свежие дни.
+
+Печатаются p50/p99 времени сценария и отдельных запросов к WakaTime,
+а также число запросов к API по статусам.
+
+Скрипты обновления кэша работают с переданной БД и REDIS_URL:
+используйте отдельные тестовые экземпляры, пользователи бенчмарка
+добавляются с telegram_id от BENCH_ID_BASE и удаляются после прогона.
+
+Запуск:
+    python -m benchmarks.run_benchmarks --users 10 100 1000 10000
+    python -m benchmarks.run_benchmarks --users 100 --database-url postgresql://.../bench
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+BENCH_ID_BASE = 10 ** 12
+
+# Только запросы рядов к API, без БД
+FETCH_SCENARIOS = ["fetch_day", "fetch_week", "fetch_month", "fetch_year"]
+# Путь обработчиков /day .. /year, нужна БД
+LEADERBOARD_SCENARIOS = ["day", "week", "month", "year"]
+
+
+def percentile(values, q):
+    """Перцентиль по методу ближайшего ранга."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, math.ceil(q / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_fake_server(args, port):
+    cmd = [
+        sys.executable, "-m", "benchmarks.fake_wakatime",
+        "--port", str(port),
+        "--latency", str(args.latency),
+        "--error-rate", str(args.error_rate),
+        "--burst-every", str(args.burst_every),
+        "--burst-length", str(args.burst_length),
+        "--detail", str(args.detail),
+    ]
+    process = subprocess.Popen(cmd)
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        try:
+            fake_request(port, "/__stats", "GET")
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("Заглушка WakaTime не запустилась")
+
+
+def fake_request(port, path, method):
+    request = urllib.request.Request(f"http://127.0.0.1:{port}{path}", method=method)
+    with urllib.request.urlopen(request, timeout=5) as resp:
+        return json.loads(resp.read())
+
+
+def make_users(count):
+    return [(BENCH_ID_BASE + i, f"bench_user_{i}", f"waka_bench_{i}") for i in range(count)]
+
+
+async def seed_users(users):
+    import db
+
+    async with db.db_pool.acquire() as conn:
+        await conn.executemany(
+            """
+            INSERT INTO users (telegram_id, username, wakatime_key) VALUES ($1, $2, $3)
+            ON CONFLICT (telegram_id) DO UPDATE
+              SET username = EXCLUDED.username, wakatime_key = EXCLUDED.wakatime_key
+        """,
+            users,
+        )
+
+
+async def cleanup_users():
+    import db
+
+    async with db.db_pool.acquire() as conn:
+        await conn.execute("DELETE FROM users WHERE telegram_id >= $1", BENCH_ID_BASE)
+
+
+def timed(fn, call_latencies):
+    """Оборачивает корутину-функцию, записывая длительность каждого вызова."""
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            call_latencies.append(time.perf_counter() - started)
+
+    return wrapper
+
+
+async def run_fetch(period, users, call_latencies):
+    """Только параллельные запросы рядов за период к API."""
+    from collector import collect_for_users
+    from wakatime_client import fetch_period_series
+
+    fetch = timed(fetch_period_series, call_latencies)
+    return await collect_for_users(users, lambda waka_key: fetch(waka_key, period))
+
+
+async def run_leaderboard(period, users, call_latencies):
+    """Сбор лидерборда тем же путём, что и в обработчике команды периода."""
+    import daily_totals
+    from collector import collect_leaderboard
+    from wakatime_client import get_coding_time_today, prefetch_period_series
+
+    if period == "day":
+        await prefetch_period_series(users, "day")
+        return await collect_leaderboard(users, timed(get_coding_time_today, call_latencies))
+
+    # Длительность загрузки дней каждого пользователя вместо отдельных запросов
+    ingest_user = daily_totals.ingest_user
+    daily_totals.ingest_user = timed(ingest_user, call_latencies)
+    try:
+        return await daily_totals.build_leaderboard(users, period)
+    finally:
+        daily_totals.ingest_user = ingest_user
+
+
+async def run_suite(args, port):
+    from wakatime_client import init_wakatime_client, close_wakatime_client
+
+    scenarios = list(FETCH_SCENARIOS)
+    if args.database_url:
+        import db
+        from redis_cache import init_redis, close_redis
+
+        await db.init_db_pool(args.database_url)
+        await init_redis()
+        scenarios += LEADERBOARD_SCENARIOS + ["refresh_month", "refresh_year", "refresh_all"]
+
+    await init_wakatime_client()
+    results = []
+    try:
+        for count in args.users:
+            users = make_users(count)
+            if args.database_url:
+                await cleanup_users()
+                await seed_users(users)
+            for scenario in scenarios:
+                fake_request(port, "/__reset", "POST")
+                wall_times, call_latencies, failed_total = [], [], 0
+                for _ in range(args.repeat):
+                    started = time.perf_counter()
+                    if scenario in FETCH_SCENARIOS:
+                        _, failed = await run_fetch(scenario[len("fetch_"):], users, call_latencies)
+                        failed_total += len(failed)
+                    elif scenario in LEADERBOARD_SCENARIOS:
+                        _, failed = await run_leaderboard(scenario, users, call_latencies)
+                        failed_total += len(failed)
+                    elif scenario == "refresh_month":
+                        from update_month_cache import update_month_cache
+                        await update_month_cache()
+                    elif scenario == "refresh_year":
+                        from update_year_cache import update_year_cache
+                        await update_year_cache()
+                    else:
+                        from update_caches import update_caches
+                        await update_caches()
+                    wall_times.append(time.perf_counter() - started)
+                stats = fake_request(port, "/__stats", "GET")
+                row = {
+                    "users": count,
+                    "scenario": scenario,
+                    "repeat": args.repeat,
+                    "wall_p50": percentile(wall_times, 50),
+                    "wall_p99": percentile(wall_times, 99),
+                    "wall_first": wall_times[0],
+                    "call_p50": percentile(call_latencies, 50),
+                    "call_p99": percentile(call_latencies, 99),
+                    "requests": stats["requests"],
+                    "statuses": stats["statuses"],
+                    "bytes": stats["bytes_sent"],
+                    "failed": failed_total,
+                }
+                results.append(row)
+                print_row(row)
+    finally:
+        await close_wakatime_client()
+        if args.database_url:
+            await cleanup_users()
+            await close_redis()
+            await db.close_db_pool()
+    return results
+
+
+def print_header():
+    print(
+        f"{'users':>6} {'scenario':>14} {'first, с':>9} {'p50, с':>8} {'p99, с':>8} "
+        f"{'call p50':>9} {'call p99':>9} {'requests':>9} {'MB':>8} {'failed':>7}  statuses"
+    )
+
+
+def print_row(row):
+    print(
+        f"{row['users']:>6} {row['scenario']:>14} {row['wall_first']:>9.3f} {row['wall_p50']:>8.3f} "
+        f"{row['wall_p99']:>8.3f} {row['call_p50']:>9.3f} {row['call_p99']:>9.3f} {row['requests']:>9} "
+        f"{row['bytes'] / 1e6:>8.2f} {row['failed']:>7}  {row['statuses']}",
+        flush=True,
+    )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк сбора лидербордов против заглушки WakaTime")
+    parser.add_argument("--users", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=3, help="Повторов каждого сценария")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.05, help="Средняя задержка заглушки, сек")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--burst-every", type=int, default=0)
+    parser.add_argument("--burst-length", type=int, default=0)
+    parser.add_argument("--detail", type=int, default=5, help="Записей в каждой детализации дня")
+    parser.add_argument("--respect-rate-limit", action="store_true",
+                        help="Не отключать ограничитель частоты запросов клиента")
+    parser.add_argument("--result-cache", action="store_true",
+                        help="Не отключать кэш рядов пользователей (повторы будут обслуживаться из кэша)")
+    parser.add_argument("--database-url", help="Тестовая БД для сценариев обновления кэша")
+    parser.add_argument("--output", help="Сохранить результаты в JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    port = free_port()
+
+    # Конфигурация читается при импорте модулей бота, поэтому задаём её заранее
+    os.environ["WAKATIME_API_URL"] = f"http://127.0.0.1:{port}/api/v1"
+    os.environ["WAKATIME_CONCURRENCY"] = str(args.concurrency)
+    os.environ.setdefault("WAKATIME_BACKOFF_BASE", "0.1")
+    if not args.respect_rate_limit:
+        for name in ("WAKATIME_RATE", "WAKATIME_BURST", "WAKATIME_KEY_RATE", "WAKATIME_KEY_BURST"):
+            os.environ[name] = "1000000"
+
+    if not args.result_cache:
+        os.environ["RESULT_CACHE_ENABLED"] = "0"
+
+    # Логи каждого запроса исказили бы замеры на тысячах пользователей
+    logging.basicConfig(level=logging.WARNING)
+
+    process = start_fake_server(args, port)
+    try:
+        print_header()
+        results = asyncio.run(run_suite(args, port))
+    finally:
+        process.terminate()
+        process.wait()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
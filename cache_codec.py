@@ -0,0 +1,126 @@
+"""
+Кодирование посуточных рядов для хранения в кэше Redis.
+
+Новые записи начинаются с заголовка MAGIC + версия схемы + id кодека.
+Записи без заголовка считаются прежним JSON-форматом
+{"t": время записи, "d": [["YYYY-MM-DD", секунды], ...]} и читаются как раньше.
+
+Кодеки:
+    binary  — упакованные порядковые номера дней (uint32) и секунды (float64)
+    msgpack — msgpack, если пакет установлен
+    json    — прежний формат без заголовка
+"""
+import json
+import struct
+import sys
+from array import array
+from datetime import date
+
+try:
+    import msgpack
+except ImportError:  # msgpack — необязательная зависимость
+    msgpack = None
+
+MAGIC = b"WKRS"
+SCHEMA_VERSION = 1
+
+CODEC_BINARY = 1
+CODEC_MSGPACK = 2
+
+_HEADER = struct.Struct("<4sBB")
+_BINARY_META = struct.Struct("<dI")  # время записи, число дней
+
+
+def _encode_json(written_at, series):
+    return json.dumps({"t": written_at, "d": [(day.isoformat(), seconds) for day, seconds in series]}).encode()
+
+
+def _decode_json(payload):
+    parsed = json.loads(payload)
+    series = parsed["d"]
+    if not isinstance(series, list):
+        raise ValueError(f"Неверный формат данных в кэше: {series!r}")
+    return parsed["t"], [(date.fromisoformat(day), float(seconds)) for day, seconds in series]
+
+
+def _encode_binary(written_at, series):
+    days = array("I", (day.toordinal() for day, _ in series))
+    seconds = array("d", (float(value) for _, value in series))
+    if sys.byteorder == "big":
+        # Массивы всегда хранятся в little-endian
+        days.byteswap()
+        seconds.byteswap()
+    return _BINARY_META.pack(written_at, len(days)) + days.tobytes() + seconds.tobytes()
+
+
+def _decode_binary(body):
+    written_at, count = _BINARY_META.unpack_from(body, 0)
+    offset = _BINARY_META.size
+    days = array("I")
+    days.frombytes(body[offset:offset + 4 * count])
+    offset += 4 * count
+    seconds = array("d")
+    seconds.frombytes(body[offset:offset + 8 * count])
+    if sys.byteorder == "big":
+        days.byteswap()
+        seconds.byteswap()
+    return written_at, [(date.fromordinal(day), value) for day, value in zip(days, seconds)]
+
+
+def _encode_msgpack(written_at, series):
+    return msgpack.packb(
+        [written_at, [day.toordinal() for day, _ in series], [float(value) for _, value in series]],
+        use_bin_type=True,
+    )
+
+
+def _decode_msgpack(body):
+    written_at, days, seconds = msgpack.unpackb(body, raw=False)
+    return written_at, [(date.fromordinal(day), float(value)) for day, value in zip(days, seconds)]
+
+
+def encode_series(written_at, series, codec="binary") -> bytes:
+    """
+    Кодирует посуточный ряд для кэша.
+
+    Args:
+        written_at: Время записи (unix time)
+        series: Список кортежей (день, секунды)
+        codec: "binary", "msgpack" или "json"; при отсутствии msgpack используется binary
+
+    Returns:
+        bytes с заголовком схемы (для json — без заголовка, как раньше)
+    """
+    if codec == "json":
+        return _encode_json(written_at, series)
+    if codec == "msgpack" and msgpack is not None:
+        return _HEADER.pack(MAGIC, SCHEMA_VERSION, CODEC_MSGPACK) + _encode_msgpack(written_at, series)
+    return _HEADER.pack(MAGIC, SCHEMA_VERSION, CODEC_BINARY) + _encode_binary(written_at, series)
+
+
+def decode_series(payload):
+    """
+    Декодирует запись кэша любого поддерживаемого формата, включая прежний JSON.
+
+    Returns:
+        Кортеж (written_at, [(день, секунды), ...])
+
+    Raises:
+        ValueError: неизвестная версия схемы или кодек
+    """
+    if isinstance(payload, str):
+        payload = payload.encode()
+    if not payload.startswith(MAGIC):
+        return _decode_json(payload)
+
+    _, version, codec = _HEADER.unpack_from(payload, 0)
+    if version != SCHEMA_VERSION:
+        raise ValueError(f"Неподдерживаемая версия схемы кэша: {version}")
+    body = payload[_HEADER.size:]
+    if codec == CODEC_BINARY:
+        return _decode_binary(body)
+    if codec == CODEC_MSGPACK:
+        if msgpack is None:
+            raise ValueError("Запись закодирована msgpack, но пакет msgpack не установлен")
+        return _decode_msgpack(body)
+    raise ValueError(f"Неизвестный кодек кэша: {codec}")
@@ -0,0 +1,154 @@
+"""
+Предохранитель (circuit breaker) для запросов к WakaTime.
+
+Пока WakaTime отвечает нормально, предохранитель замкнут и только
+запоминает исходы запросов за скользящее окно. Если доля ошибок
+и слишком медленных ответов становится высокой, он размыкается:
+запросы отклоняются сразу, без ожидания таймаутов, а обработчики
+отвечают последними известными данными. Через open_seconds первый
+запрос становится пробным, остальные ждут его исхода: успех замыкает
+предохранитель, ошибка снова размыкает его.
+
+Состояние у каждого процесса своё.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+
+from config import (
+    WAKATIME_BREAKER_ENABLED,
+    WAKATIME_BREAKER_WINDOW,
+    WAKATIME_BREAKER_MIN_REQUESTS,
+    WAKATIME_BREAKER_ERROR_RATIO,
+    WAKATIME_BREAKER_SLOW,
+    WAKATIME_BREAKER_OPEN_SECONDS,
+)
+from metrics import WAKATIME_BREAKER_STATE
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitBreaker:
+    """
+    Args:
+        window: Окно в секундах, за которое считается доля ошибок
+        min_requests: Минимум запросов в окне, чтобы принимать решение
+        error_ratio: Доля неудачных запросов, при которой предохранитель размыкается
+        slow_seconds: Запрос дольше этого считается неудачным
+        open_seconds: Сколько секунд предохранитель остаётся разомкнутым до пробного запроса
+        enabled: При False запросы всегда разрешены
+    """
+
+    def __init__(self, window, min_requests, error_ratio, slow_seconds, open_seconds, enabled=True):
+        self.window = window
+        self.min_requests = min_requests
+        self.error_ratio = error_ratio
+        self.slow_seconds = slow_seconds
+        self.open_seconds = open_seconds
+        self.enabled = enabled
+        self.state = CLOSED
+        self.opened_at = 0.0
+        # Исходы запросов в окне: (время, неудачный ли)
+        self._calls = deque()
+        self._failures = 0
+        # Событие завершения пробного запроса в состоянии HALF_OPEN
+        self._probe: asyncio.Event = None
+
+    def _set_state(self, state):
+        self.state = state
+        WAKATIME_BREAKER_STATE.set(_STATE_VALUES[state])
+
+    def _refresh(self):
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.open_seconds:
+            self._set_state(HALF_OPEN)
+            self._probe = None
+
+    @property
+    def is_open(self) -> bool:
+        """Разомкнут ли предохранитель: запросы к WakaTime сейчас не выполняются."""
+        self._refresh()
+        return self.state == OPEN
+
+    async def acquire(self) -> bool:
+        """
+        Решает, можно ли выполнить запрос. В состоянии HALF_OPEN первый
+        вызов выполняет пробный запрос, остальные ждут его исхода.
+
+        Returns:
+            False, если запрос нужно отклонить без обращения к WakaTime
+        """
+        if not self.enabled:
+            return True
+        while True:
+            self._refresh()
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                return False
+            if self._probe is None:
+                self._probe = asyncio.Event()
+                return True
+            await self._probe.wait()
+
+    def record(self, ok: bool, seconds: float):
+        """
+        Учитывает исход запроса.
+
+        Args:
+            ok: WakaTime ответил (в том числе 4xx); False — 5xx или сетевая ошибка
+            seconds: Длительность запроса
+        """
+        if not self.enabled:
+            return
+        failed = not ok or seconds >= self.slow_seconds
+        if self.state == HALF_OPEN:
+            probe, self._probe = self._probe, None
+            if failed:
+                self._open("пробный запрос не удался")
+            else:
+                self._close()
+            if probe is not None:
+                probe.set()
+            return
+        if self.state == OPEN:
+            # Запросы, начатые до размыкания, на решение уже не влияют
+            return
+
+        now = time.monotonic()
+        self._calls.append((now, failed))
+        self._failures += failed
+        while self._calls and self._calls[0][0] < now - self.window:
+            self._failures -= self._calls.popleft()[1]
+        if len(self._calls) >= self.min_requests and self._failures >= len(self._calls) * self.error_ratio:
+            self._open(f"{self._failures} неудачных из {len(self._calls)} запросов за {self.window:.0f} сек")
+
+    def _open(self, reason: str):
+        logging.error(
+            f"Предохранитель WakaTime разомкнут: {reason}, пробный запрос через {self.open_seconds:.0f} сек"
+        )
+        self._set_state(OPEN)
+        self.opened_at = time.monotonic()
+        self._calls.clear()
+        self._failures = 0
+
+    def _close(self):
+        logging.info("WakaTime снова отвечает, предохранитель замкнут")
+        self._set_state(CLOSED)
+        self._calls.clear()
+        self._failures = 0
+
+
+# Общий предохранитель для всех запросов процесса к WakaTime
+waka_breaker = CircuitBreaker(
+    WAKATIME_BREAKER_WINDOW,
+    WAKATIME_BREAKER_MIN_REQUESTS,
+    WAKATIME_BREAKER_ERROR_RATIO,
+    WAKATIME_BREAKER_SLOW,
+    WAKATIME_BREAKER_OPEN_SECONDS,
+    enabled=WAKATIME_BREAKER_ENABLED,
+)
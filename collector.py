@@ -0,0 +1,88 @@
+"""
+Параллельный сбор статистики WakaTime для лидербордов.
+"""
+import asyncio
+import logging
+import random
+
+from config import WAKATIME_CONCURRENCY, WAKATIME_TIMEOUT, WAKATIME_MAX_FAILED_RATIO
+from key_health import is_auth_error, record_key_results
+
+
+async def collect_for_users(users, fetch, concurrency=None, timeout=None, jitter=0):
+    """
+    Вызывает fetch(waka_key) для всех пользователей с ключом параллельно.
+
+    Число одновременных запросов ограничено семафором, а каждый вызов
+    ограничен по времени. Пользователи, для которых запрос завершился
+    ошибкой или по таймауту, не попадают в результаты, а перечисляются
+    отдельно, чтобы их нельзя было спутать с нулевым временем. Ошибки
+    авторизации и успехи учитываются в состоянии ключей (key_health.py).
+
+    Args:
+        users: Список кортежей (telegram_id, username, wakatime_key)
+        fetch: Корутина fetch(waka_key) -> результат
+        concurrency: Максимум одновременных запросов (по умолчанию WAKATIME_CONCURRENCY)
+        timeout: Срок на одного пользователя в секундах (по умолчанию WAKATIME_TIMEOUT)
+        jitter: Максимальная случайная задержка перед запросом пользователя в секундах,
+            чтобы фоновые обновления не били в WakaTime все одновременно
+
+    Returns:
+        Кортеж (results, failed): results — список (username, результат)
+        в порядке исходного списка, failed — список username с ошибкой
+    """
+    semaphore = asyncio.Semaphore(concurrency or WAKATIME_CONCURRENCY)
+    timeout = timeout or WAKATIME_TIMEOUT
+
+    ok_keys, auth_failed_keys = [], []
+
+    async def fetch_one(username, waka_key):
+        if jitter:
+            await asyncio.sleep(random.uniform(0, jitter))
+        async with semaphore:
+            try:
+                result = await asyncio.wait_for(fetch(waka_key), timeout)
+                ok_keys.append(waka_key)
+                return username, result, True
+            except asyncio.TimeoutError:
+                logging.error(f"Таймаут запроса к WakaTime для @{username}")
+            except Exception as e:
+                if is_auth_error(e):
+                    auth_failed_keys.append(waka_key)
+                logging.error(f"Ошибка получения статистики для @{username}: {e}")
+        return username, None, False
+
+    tasks = [
+        fetch_one(username, waka_key)
+        for tg_id, username, waka_key in users
+        if waka_key
+    ]
+    results, failed = [], []
+    for username, result, ok in await asyncio.gather(*tasks):
+        if ok:
+            results.append((username, result))
+        else:
+            failed.append(username)
+    await record_key_results(ok_keys, auth_failed_keys)
+    return results, failed
+
+
+def is_cacheable(succeeded: int, failed: int) -> bool:
+    """
+    Можно ли кэшировать результат сбора: доля ошибок не превышает
+    WAKATIME_MAX_FAILED_RATIO. Иначе, например при серии 429, в кэш
+    попал бы лидерборд с пропусками.
+    """
+    total = succeeded + failed
+    return total > 0 and failed <= total * WAKATIME_MAX_FAILED_RATIO
+
+
+async def collect_leaderboard(users, fetch, concurrency=None, timeout=None):
+    """
+    Собирает лидерборд: fetch(waka_key) возвращает минуты кодинга.
+
+    Returns:
+        Кортеж (leaderboard, failed): список (username, minutes) и список username с ошибкой
+    """
+    return await collect_for_users(users, fetch, concurrency, timeout)
+
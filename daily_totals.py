@@ -0,0 +1,180 @@
+"""
+Инкрементальная загрузка посуточного времени кодинга в таблицу daily_totals
+и построение лидербордов по сохранённым данным.
+"""
+import logging
+from datetime import datetime, timedelta
+
+from aggregation import RollingAggregator
+from collector import collect_for_users
+from config import DAILY_TOTALS_REFETCH_DAYS
+from db import get_daily_totals_changed, get_last_ingested_at, get_last_ingested_days, save_daily_totals
+from result_cache import result_cache
+from wakatime_client import PERIOD_DAYS, fetch_daily_totals, period_range
+
+# Глубина истории, которую имеет смысл хранить: самый длинный период
+HISTORY_DAYS = max(PERIOD_DAYS.values())
+
+# Запас при инкрементальной синхронизации: строки, записанные транзакциями,
+# которые закоммитились позже нашего чтения, перечитываются повторно
+SYNC_MARGIN = timedelta(seconds=60)
+
+# Скользящие итоги процесса, синхронизируемые с таблицей daily_totals
+aggregator = RollingAggregator(HISTORY_DAYS)
+_synced_at = None
+
+
+def ingestion_start(last_day, today):
+    """
+    Определяет первый день, который нужно запросить у WakaTime для пользователя.
+
+    Прошлые дни запрашиваются один раз, а последние DAILY_TOTALS_REFETCH_DAYS
+    дней (сегодня и вчера) перезапрашиваются всегда, т.к. могут ещё меняться.
+    """
+    history_start = today - timedelta(days=HISTORY_DAYS - 1)
+    if last_day is None:
+        return history_start
+    refetch_start = today - timedelta(days=DAILY_TOTALS_REFETCH_DAYS - 1)
+    return max(history_start, min(last_day + timedelta(days=1), refetch_start))
+
+
+async def ingestion_plan(users, today):
+    """
+    Определяет для каждого пользователя с ключом, с какого дня догружать итоги.
+
+    Returns:
+        Список кортежей (telegram_id, username, wakatime_key, start)
+    """
+    last_days = await get_last_ingested_days()
+    return [
+        (tg_id, username, waka_key, ingestion_start(last_days.get(tg_id), today))
+        for tg_id, username, waka_key in users
+        if waka_key
+    ]
+
+
+async def ingest_user(telegram_id, waka_key, start, end, period="history"):
+    """
+    Запрашивает у WakaTime дни start..end одного пользователя и сохраняет их в daily_totals.
+
+    При ошибке запроса fetch_daily_totals бросает исключение и ничего не сохраняется:
+    недостающие дни будут запрошены при следующей загрузке.
+    """
+    series = await fetch_daily_totals(waka_key, start, end, period)
+    await save_daily_totals(telegram_id, series)
+
+
+async def ingest_daily_totals(users, jitter=0, period="history"):
+    """
+    Догружает в daily_totals недостающие и изменяемые дни для всех пользователей с ключом.
+
+    Args:
+        users: Список кортежей (telegram_id, username, wakatime_key)
+        jitter: Максимальная случайная задержка перед запросом пользователя в секундах
+        period: Метка периода, ради которого идёт загрузка, для метрик запросов
+
+    Returns:
+        Кортеж (ingested, failed): число пользователей с сохранёнными данными
+        и список username, для которых данные получить не удалось
+    """
+    today = datetime.now().date()
+    starts = {waka_key: (tg_id, start) for tg_id, username, waka_key, start in await ingestion_plan(users, today)}
+
+    # Закэшированные ряды всех пользователей читаются из Redis одним запросом
+    await result_cache.prefetch([(waka_key, start, today) for waka_key, (_, start) in starts.items()], period)
+
+    async def fetch(waka_key):
+        tg_id, start = starts[waka_key]
+        await ingest_user(tg_id, waka_key, start, today, period)
+
+    results, failed = await collect_for_users(users, fetch, jitter=jitter)
+    logging.info(f"Посуточные итоги обновлены для {len(results)} из {len(results) + len(failed)} пользователей")
+    return len(results), failed
+
+
+async def sync_aggregator():
+    """
+    Подтягивает в агрегатор изменённые строки daily_totals.
+
+    Первый вызов читает всю историю, последующие — только строки,
+    изменённые с прошлой синхронизации (обычно сегодня и вчера).
+    """
+    global _synced_at
+    today = datetime.now().date()
+    since = _synced_at - SYNC_MARGIN if _synced_at is not None else None
+    rows, synced_at = await get_daily_totals_changed(today - timedelta(days=HISTORY_DAYS - 1), since)
+    for tg_id, day, seconds in rows:
+        aggregator.set_day(tg_id, day, seconds, today)
+    _synced_at = synced_at
+    logging.info(f"Агрегатор синхронизирован, применено {len(rows)} строк")
+
+
+async def period_entries(users, period):
+    """
+    Возвращает итоги за период по уже загруженным данным, без запросов к WakaTime.
+
+    Returns:
+        Список кортежей (telegram_id, username, minutes)
+    """
+    await sync_aggregator()
+    return aggregator.entries(users, *period_range(period))
+
+
+async def period_leaderboard(users, period):
+    """
+    Возвращает лидерборд за период по уже загруженным данным, без запросов к WakaTime.
+
+    Returns:
+        Список кортежей (username, minutes)
+    """
+    return [(username, minutes) for _, username, minutes in await period_entries(users, period)]
+
+
+async def last_known_entries(users, period):
+    """
+    Итоги за период по последним загруженным данным, когда WakaTime недоступен.
+
+    Returns:
+        Кортеж (entries, updated_at): список (telegram_id, username, minutes) и момент
+        последнего обновления данных этих пользователей (None, если данных нет)
+    """
+    entries = await period_entries(users, period)
+    updated_at = await get_last_ingested_at([tg_id for tg_id, _, _ in users])
+    return entries, updated_at
+
+
+async def last_known_leaderboard(users, period):
+    """
+    Лидерборд за период по последним загруженным данным, когда WakaTime недоступен.
+
+    Returns:
+        Кортеж (leaderboard, updated_at): список (username, minutes) и момент
+        последнего обновления данных этих пользователей (None, если данных нет)
+    """
+    entries, updated_at = await last_known_entries(users, period)
+    return [(username, minutes) for _, username, minutes in entries], updated_at
+
+
+async def build_entries(users, period, jitter=0):
+    """
+    Догружает свежие дни и возвращает итоги за период.
+    Итоги считаются по префиксным суммам агрегатора за O(1) на пользователя.
+
+    Returns:
+        Кортеж (entries, failed): список (telegram_id, username, minutes) и список username,
+        чьи свежие дни получить не удалось (их итог может быть неполным)
+    """
+    ingested, failed = await ingest_daily_totals(users, jitter, period)
+    return await period_entries(users, period), failed
+
+
+async def build_leaderboard(users, period, jitter=0):
+    """
+    Догружает свежие дни и возвращает лидерборд за период.
+
+    Returns:
+        Кортеж (leaderboard, failed): список (username, minutes) и список username,
+        чьи свежие дни получить не удалось (их итог может быть неполным)
+    """
+    entries, failed = await build_entries(users, period, jitter)
+    return [(username, minutes) for _, username, minutes in entries], failed
@@ -5,6 +5,9 @@ db_pool: asyncpg.Pool = None
 
 async def init_db_pool(database_url: str):
     global db_pool
+    # Пул создаётся один раз на процесс, повторные вызовы его переиспользуют
+    if db_pool is not None:
+        return
     db_pool = await asyncpg.create_pool(database_url)
     async with db_pool.acquire() as conn:
         await conn.execute(
@@ -16,6 +19,103 @@ async def init_db_pool(database_url: str):
             )
         """
         )
+        await conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS daily_totals (
+                telegram_id BIGINT NOT NULL REFERENCES users (telegram_id) ON DELETE CASCADE,
+                day DATE NOT NULL,
+                seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+                PRIMARY KEY (telegram_id, day)
+            )
+        """
+        )
+        await conn.execute(
+            "CREATE INDEX IF NOT EXISTS daily_totals_day_idx ON daily_totals (day)"
+        )
+        # Время изменения строки нужно для инкрементальной синхронизации агрегатов
+        await conn.execute(
+            "ALTER TABLE daily_totals ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now()"
+        )
+        await conn.execute(
+            "CREATE INDEX IF NOT EXISTS daily_totals_updated_at_idx ON daily_totals (updated_at)"
+        )
+        # Участники чатов: по ним строятся лидерборды групп
+        await conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS chat_members (
+                chat_id BIGINT NOT NULL,
+                telegram_id BIGINT NOT NULL,
+                PRIMARY KEY (chat_id, telegram_id)
+            )
+        """
+        )
+        await conn.execute(
+            "CREATE INDEX IF NOT EXISTS chat_members_telegram_id_idx ON chat_members (telegram_id)"
+        )
+        # Состояние ключа: ошибки авторизации подряд и срок карантина (key_health.py)
+        await conn.execute(
+            "ALTER TABLE users ADD COLUMN IF NOT EXISTS key_failures INT NOT NULL DEFAULT 0"
+        )
+        await conn.execute(
+            "ALTER TABLE users ADD COLUMN IF NOT EXISTS key_quarantined_until TIMESTAMPTZ"
+        )
+        # Лидерборды читают только пользователей с ключом
+        await conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS users_with_key_idx ON users (telegram_id)
+            WHERE wakatime_key IS NOT NULL AND wakatime_key <> ''
+        """
+        )
+        # Уведомления об изменениях для реестра пользователей в памяти процессов (user_registry.py)
+        await conn.execute(
+            """
+            CREATE OR REPLACE FUNCTION notify_users_changed() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP = 'DELETE' THEN
+                    PERFORM pg_notify('users_changed', OLD.telegram_id::text);
+                ELSE
+                    PERFORM pg_notify('users_changed', NEW.telegram_id::text);
+                END IF;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+        """
+        )
+        await conn.execute(
+            """
+            CREATE OR REPLACE TRIGGER users_changed_notify
+            AFTER INSERT OR UPDATE OR DELETE ON users
+            FOR EACH ROW EXECUTE FUNCTION notify_users_changed()
+        """
+        )
+        await conn.execute(
+            """
+            CREATE OR REPLACE FUNCTION notify_chat_members_changed() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP = 'DELETE' THEN
+                    PERFORM pg_notify('chat_members_changed', 'DELETE:' || OLD.chat_id || ':' || OLD.telegram_id);
+                ELSE
+                    PERFORM pg_notify('chat_members_changed', TG_OP || ':' || NEW.chat_id || ':' || NEW.telegram_id);
+                END IF;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+        """
+        )
+        await conn.execute(
+            """
+            CREATE OR REPLACE TRIGGER chat_members_changed_notify
+            AFTER INSERT OR DELETE ON chat_members
+            FOR EACH ROW EXECUTE FUNCTION notify_chat_members_changed()
+        """
+        )
+
+
+async def close_db_pool():
+    global db_pool
+    if db_pool is not None:
+        await db_pool.close()
+        db_pool = None
 
 
 async def save_contact(username: str, telegram_id: int):
@@ -45,17 +145,242 @@ async def save_wakatime_key(telegram_id: int, waka_key: str):
             INSERT INTO users (telegram_id, wakatime_key)
             VALUES ($1, $2)
             ON CONFLICT (telegram_id) DO UPDATE
-              SET wakatime_key = EXCLUDED.wakatime_key
+              SET wakatime_key = EXCLUDED.wakatime_key,
+                  key_failures = 0,
+                  key_quarantined_until = NULL
         """,
             telegram_id,
             waka_key,
         )
 
 
-async def get_all_users():
+async def get_chat_users(chat_id: int):
     """
-    Возвращает список кортежей (telegram_id, username, wakatime_key) для всех пользователей.
+    Возвращает список кортежей (telegram_id, username, wakatime_key) для участников чата,
+    кроме пользователей с ключом на карантине.
     """
     async with db_pool.acquire() as conn:
-        rows = await conn.fetch("SELECT telegram_id, username, wakatime_key FROM users")
+        rows = await conn.fetch(
+            """
+            SELECT u.telegram_id, u.username, u.wakatime_key
+            FROM chat_members m
+            JOIN users u ON u.telegram_id = m.telegram_id
+            WHERE m.chat_id = $1
+              AND (u.key_quarantined_until IS NULL OR u.key_quarantined_until <= now())
+        """,
+            chat_id,
+        )
     return [(row["telegram_id"], row["username"], row["wakatime_key"]) for row in rows]
+
+
+async def get_users_with_key():
+    """
+    Возвращает список кортежей (telegram_id, username, wakatime_key) для пользователей
+    с ключом, кроме ключей на карантине.
+    """
+    async with db_pool.acquire() as conn:
+        rows = await conn.fetch(
+            """
+            SELECT telegram_id, username, wakatime_key FROM users
+            WHERE wakatime_key IS NOT NULL AND wakatime_key <> ''
+              AND (key_quarantined_until IS NULL OR key_quarantined_until <= now())
+        """
+        )
+    return [(row["telegram_id"], row["username"], row["wakatime_key"]) for row in rows]
+
+
+async def get_key_users():
+    """
+    Возвращает список кортежей (telegram_id, username, wakatime_key, key_failures,
+    key_quarantined_until) для всех пользователей с ключом, включая карантин.
+    """
+    async with db_pool.acquire() as conn:
+        rows = await conn.fetch(
+            """
+            SELECT telegram_id, username, wakatime_key, key_failures, key_quarantined_until FROM users
+            WHERE wakatime_key IS NOT NULL AND wakatime_key <> ''
+        """
+        )
+    return [tuple(row) for row in rows]
+
+
+async def get_user(telegram_id: int):
+    """
+    Возвращает кортеж (telegram_id, username, wakatime_key, key_failures,
+    key_quarantined_until) или None.
+    """
+    async with db_pool.acquire() as conn:
+        row = await conn.fetchrow(
+            """
+            SELECT telegram_id, username, wakatime_key, key_failures, key_quarantined_until
+            FROM users WHERE telegram_id = $1
+        """,
+            telegram_id,
+        )
+    return tuple(row) if row else None
+
+
+async def record_key_failures(waka_keys, threshold: int, base_interval: float, max_interval: float):
+    """
+    Увеличивает счётчик ошибок авторизации ключей. Ключ, набравший threshold
+    ошибок подряд, уходит на карантин на base_interval секунд, каждая следующая
+    ошибка удваивает интервал (не больше max_interval).
+
+    Returns:
+        Список кортежей (telegram_id, key_failures, key_quarantined_until) изменённых строк
+    """
+    async with db_pool.acquire() as conn:
+        rows = await conn.fetch(
+            """
+            UPDATE users
+            SET key_failures = key_failures + 1,
+                key_quarantined_until = CASE
+                    WHEN key_failures + 1 >= $2 THEN now() + make_interval(
+                        secs => LEAST($4::float8, $3::float8 * power(2, key_failures + 1 - $2))
+                    )
+                END
+            WHERE wakatime_key = ANY($1::text[])
+            RETURNING telegram_id, key_failures, key_quarantined_until
+        """,
+            list(waka_keys),
+            threshold,
+            base_interval,
+            max_interval,
+        )
+    return [tuple(row) for row in rows]
+
+
+async def reset_key_failures(waka_keys):
+    """
+    Сбрасывает счётчик ошибок и карантин ключей, запрос по которым прошёл успешно.
+    Строки без ошибок не изменяются.
+
+    Returns:
+        Число пользователей, у которых счётчик был сброшен
+    """
+    async with db_pool.acquire() as conn:
+        status = await conn.execute(
+            """
+            UPDATE users SET key_failures = 0, key_quarantined_until = NULL
+            WHERE wakatime_key = ANY($1::text[]) AND key_failures > 0
+        """,
+            list(waka_keys),
+        )
+    # asyncpg возвращает статус команды вида "UPDATE 3"
+    return int(status.split()[-1])
+
+
+async def get_chat_member_ids(chat_id: int):
+    """
+    Возвращает множество telegram_id участников чата.
+    """
+    async with db_pool.acquire() as conn:
+        rows = await conn.fetch("SELECT telegram_id FROM chat_members WHERE chat_id = $1", chat_id)
+    return {row["telegram_id"] for row in rows}
+
+
+async def add_chat_member(chat_id: int, telegram_id: int):
+    """
+    Отмечает пользователя участником чата.
+    """
+    async with db_pool.acquire() as conn:
+        await conn.execute(
+            "INSERT INTO chat_members (chat_id, telegram_id) VALUES ($1, $2) ON CONFLICT DO NOTHING",
+            chat_id,
+            telegram_id,
+        )
+
+
+async def remove_chat_member(chat_id: int, telegram_id: int):
+    """
+    Удаляет пользователя из участников чата.
+    """
+    async with db_pool.acquire() as conn:
+        await conn.execute(
+            "DELETE FROM chat_members WHERE chat_id = $1 AND telegram_id = $2",
+            chat_id,
+            telegram_id,
+        )
+
+
+async def remove_chat(chat_id: int):
+    """
+    Удаляет всех участников чата, например когда бота исключили из группы.
+    """
+    async with db_pool.acquire() as conn:
+        await conn.execute("DELETE FROM chat_members WHERE chat_id = $1", chat_id)
+
+
+async def get_wakatime_key(telegram_id: int):
+    """
+    Возвращает WakaTime API ключ пользователя или None.
+    """
+    async with db_pool.acquire() as conn:
+        return await conn.fetchval("SELECT wakatime_key FROM users WHERE telegram_id = $1", telegram_id)
+
+
+async def save_daily_totals(telegram_id: int, series):
+    """
+    Сохраняет или обновляет посуточное время кодинга пользователя.
+
+    Args:
+        series: Список кортежей (день, секунды)
+    """
+    if not series:
+        return
+    async with db_pool.acquire() as conn:
+        await conn.executemany(
+            """
+            INSERT INTO daily_totals (telegram_id, day, seconds)
+            VALUES ($1, $2, $3)
+            ON CONFLICT (telegram_id, day) DO UPDATE
+              SET seconds = EXCLUDED.seconds, updated_at = now()
+              WHERE daily_totals.seconds IS DISTINCT FROM EXCLUDED.seconds
+        """,
+            [(telegram_id, day, seconds) for day, seconds in series],
+        )
+
+
+async def get_last_ingested_days():
+    """
+    Возвращает словарь {telegram_id: последний сохранённый день} по таблице daily_totals.
+    """
+    async with db_pool.acquire() as conn:
+        rows = await conn.fetch(
+            "SELECT telegram_id, MAX(day) AS last_day FROM daily_totals GROUP BY telegram_id"
+        )
+    return {row["telegram_id"]: row["last_day"] for row in rows}
+
+
+async def get_last_ingested_at(telegram_ids):
+    """
+    Возвращает момент последнего обновления daily_totals для указанных пользователей или None.
+    """
+    async with db_pool.acquire() as conn:
+        return await conn.fetchval(
+            "SELECT MAX(updated_at) FROM daily_totals WHERE telegram_id = ANY($1::bigint[])",
+            list(telegram_ids),
+        )
+
+
+async def get_daily_totals_changed(start_day, since=None):
+    """
+    Возвращает посуточные итоги начиная с start_day, изменённые после момента since
+    (все, если since не задан), и момент, до которого данные гарантированно прочитаны.
+
+    Returns:
+        Кортеж (rows, synced_at): rows — список (telegram_id, day, seconds)
+    """
+    async with db_pool.acquire() as conn:
+        synced_at = await conn.fetchval("SELECT now()")
+        rows = await conn.fetch(
+            """
+            SELECT telegram_id, day, seconds
+            FROM daily_totals
+            WHERE day >= $1 AND ($2::timestamptz IS NULL OR updated_at > $2)
+        """,
+            start_day,
+            since,
+        )
+    return [(row["telegram_id"], row["day"], row["seconds"]) for row in rows], synced_at
+
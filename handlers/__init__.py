@@ -5,6 +5,7 @@ from .top_week import top_week_handler
 from .top_month import top_month_handler
 from .top_year import top_year_handler
 from .help import help_handler
+from .chat_members import chat_member_handler
 __all__ = [
     "contact_handler",
     "save_contact",
@@ -14,4 +15,5 @@ __all__ = [
     "top_month_handler",
     "top_year_handler",
     "help_handler",
+    "chat_member_handler",
 ]
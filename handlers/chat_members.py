@@ -0,0 +1,74 @@
+import logging
+
+from aiogram import Router, types
+from db import add_chat_member, remove_chat_member, remove_chat
+
+router = Router()
+
+# Статусы, при которых пользователь считается участником чата
+MEMBER_STATUSES = {"creator", "administrator", "member", "restricted"}
+
+# Уже записанные пары (chat_id, telegram_id), чтобы не писать в БД на каждое сообщение
+_known_members = set()
+_KNOWN_MEMBERS_LIMIT = 100000
+
+
+async def _add_member(chat_id: int, telegram_id: int):
+    if (chat_id, telegram_id) in _known_members:
+        return
+    await add_chat_member(chat_id, telegram_id)
+    if len(_known_members) >= _KNOWN_MEMBERS_LIMIT:
+        _known_members.clear()
+    _known_members.add((chat_id, telegram_id))
+
+
+async def _remove_member(chat_id: int, telegram_id: int):
+    _known_members.discard((chat_id, telegram_id))
+    await remove_chat_member(chat_id, telegram_id)
+
+
+async def track_chat_activity(handler, event: types.Message, data):
+    """
+    Middleware: запоминает авторов сообщений в группах как участников чата.
+    Служебные сообщения о входе и выходе обновляют состав чата.
+    """
+    try:
+        if event.chat.type in ("group", "supergroup"):
+            if event.from_user and not event.from_user.is_bot:
+                await _add_member(event.chat.id, event.from_user.id)
+            for user in event.new_chat_members or []:
+                if not user.is_bot:
+                    await _add_member(event.chat.id, user.id)
+            if event.left_chat_member and not event.left_chat_member.is_bot:
+                await _remove_member(event.chat.id, event.left_chat_member.id)
+    except Exception as e:
+        # Учёт участников не должен мешать обработке команды
+        logging.error(f"Ошибка учёта участников чата {event.chat.id}: {e}")
+    return await handler(event, data)
+
+
+@router.chat_member()
+async def chat_member_handler(update: types.ChatMemberUpdated):
+    """
+    Обновляет состав чата по событиям chat_member.
+    Telegram присылает их, только если бот — администратор группы.
+    """
+    user = update.new_chat_member.user
+    if user.is_bot:
+        return
+    if update.new_chat_member.status in MEMBER_STATUSES:
+        await _add_member(update.chat.id, user.id)
+    else:
+        await _remove_member(update.chat.id, user.id)
+
+
+@router.my_chat_member()
+async def my_chat_member_handler(update: types.ChatMemberUpdated):
+    """
+    Забывает состав чата, когда бота исключили из группы.
+    """
+    if update.new_chat_member.status not in MEMBER_STATUSES:
+        for key in [key for key in _known_members if key[0] == update.chat.id]:
+            _known_members.discard(key)
+        await remove_chat(update.chat.id)
+        logging.info(f"Бот удалён из чата {update.chat.id}, участники забыты")
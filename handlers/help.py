@@ -36,6 +36,8 @@ async def help_handler(message: types.Message):
             /year - Статистика за год
             /help - Показать это сообщение
 
+            В группе учитываются только участники чата. Общий топ: /day all, /week all и т.д.
+
             Для регистрации и настройки перейдите в <a href="https://t.me/niciwaka_bot">личный чат с ботом</a>
         """
     
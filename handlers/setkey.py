@@ -2,16 +2,26 @@ from aiogram import Router, types
 from aiogram.filters import Command
 from aiogram.filters.command import CommandObject
 from db import save_wakatime_key
+from wakatime_client import validate_key
 
 router = Router()
 
 @router.message(Command("setkey"))
 async def setkey_handler(message: types.Message, command: CommandObject):
     """
-    Сохраняет WakaTime API ключ, переданный пользователем.
+    Проверяет WakaTime API ключ, переданный пользователем, и сохраняет его.
+    Ключ, отклонённый WakaTime, не сохраняется.
     """
     if not command.args:
         await message.answer("Пожалуйста, укажи свой WakaTime API ключ: /setkey &lt;твой API ключ&gt;")
         return
-    await save_wakatime_key(message.from_user.id, command.args.strip())
+    api_key = command.args.strip()
+    valid = await validate_key(api_key)
+    if valid is False:
+        await message.answer("WakaTime не принял этот API ключ. Проверь его на https://wakatime.com/settings/account и отправь снова.")
+        return
+    await save_wakatime_key(message.from_user.id, api_key)
+    if valid is None:
+        await message.answer("WakaTime API ключ сохранён, но проверить его сейчас не удалось: WakaTime недоступен.")
+        return
     await message.answer("WakaTime API ключ сохранён! Теперь используй /top или /week для получения статистики.")
@@ -4,6 +4,7 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import FSInputFile
 from db import save_contact, save_wakatime_key
+from wakatime_client import validate_key
 import os
 import logging
 
@@ -148,16 +149,28 @@ async def contact_handler(message: types.Message, state: FSMContext):
 @router.message(RegistrationStates.waiting_for_api_key)
 async def api_key_handler(message: types.Message, state: FSMContext):
     """
-    Обрабатывает полученный API ключ и завершает регистрацию.
+    Проверяет полученный API ключ и завершает регистрацию.
+    Если WakaTime отклонил ключ, состояние сохраняется и ключ запрашивается снова.
     """
-    api_key = message.text.strip()
+    api_key = (message.text or "").strip()
 
     if not api_key:
         await message.answer("Пожалуйста, отправь мне свой WakaTime API ключ.")
         return
 
+    valid = await validate_key(api_key)
+    if valid is False:
+        await message.answer(
+            "WakaTime не принял этот API ключ. Проверь его на https://wakatime.com/settings/account "
+            "и отправь снова."
+        )
+        return
+
     await save_wakatime_key(message.from_user.id, api_key)
 
+    if valid is None:
+        await message.answer("Проверить ключ сейчас не удалось: WakaTime недоступен. Ключ сохранён без проверки.")
+
     await message.answer(
         "WakaTime API ключ сохранён! Регистрация успешно завершена.\n\n"
         "Теперь используй команды:\n"
@@ -1,32 +1,118 @@
+import logging
+from datetime import date, datetime, timedelta, timezone
+
 from aiogram import Router, types, F
 from aiogram.filters import Command
-from db import get_all_users
-from wakatime_client import get_coding_time_month
-from redis_cache import get_month_stats, save_month_stats
-from utils import format_time, format_username
+from aiogram.filters.command import CommandObject
+from user_registry import user_registry
+from daily_totals import build_entries, ingest_daily_totals, last_known_entries, period_entries
+from circuit_breaker import waka_breaker
+from collector import is_cacheable
+from redis_cache import save_month_stats, get_leaderboard_age, is_stale, get_top, get_around, get_leaderboard_size, get_scores
+from singleflight import leaderboard_flight
+from config import LEADERBOARD_TOP_N, LEADERBOARD_AROUND
+from utils import rank_leaderboard, format_ranked_lines, leaderboard_chat_id, format_scope_note, format_degraded_note
 
 router = Router()
 
+
+async def rebuild_month_stats(users=None):
+    """
+    Собирает статистику за месяц и сохраняет её в кэш.
+
+    Returns:
+        Список кортежей (telegram_id, username, minutes)
+    """
+    if users is None:
+        users = await user_registry.get_users()
+    ingested, failed = await ingest_daily_totals(users, period="month")
+    entries = await period_entries(users, "month")
+    # Сохраняем данные в кэш, только если сбор не сорвался из-за ошибок WakaTime
+    if is_cacheable(len(entries) - len(failed), len(failed)):
+        await save_month_stats(entries)
+    else:
+        logging.warning(f"Слишком много ошибок WakaTime ({len(failed)}), месячную статистику не кэшируем")
+    return entries
+
+
 @router.message(Command("month"))
-async def top_month_handler(message: types.Message):
+async def top_month_handler(message: types.Message, command: CommandObject):
     """
     Формирует лидерборд участников по времени кодинга за последние 30 дней.
-    Отображает username как ссылку и время в формате часы и минуты.
+    Отображает username как ссылку (пользователей без username — подписью)
+    и время в формате часы и минуты. Автор команды ищется по telegram_id.
     Работает как в личных сообщениях, так и в группах.
-    Использует кэш Redis для ускорения ответа.
+    Использует кэш Redis для ускорения ответа: устаревшие данные отдаются
+    сразу, а обновление запускается в фоне. Показывает первые места
+    и место автора команды, не загружая весь лидерборд из Redis.
+    В группе учитываются только участники чата: их время берётся из того же
+    кэша одним ZMSCORE. С аргументом all показывается общий лидерборд.
+    Пока предохранитель WakaTime разомкнут, кэш не обновляется, а при пустом
+    кэше лидерборд строится по последним загруженным данным с пометкой возраста.
     """
     # Проверяем, не групповой ли это чат
     is_private = message.chat.type == "private"
-    
-    # Пытаемся получить данные из кэша
-    cached_stats = get_month_stats()
-    
-    # Если данные есть в кэше, используем их
-    if cached_stats is not None:
-        leaderboard = cached_stats
+
+    caller_id = message.from_user.id
+
+    # В группах лидерборд строится только по участникам чата, "/month all" — по всем
+    chat_id = leaderboard_chat_id(message, command.args)
+    if chat_id is not None:
+        users = await user_registry.get_chat_users(chat_id)
+        if not users:
+            await message.answer(
+                "В этом чате пока нет участников с WakaTime API ключом. "
+                "Общий топ: /month all"
+            )
+            return
+
+    # Проверяем, есть ли лидерборд в кэше
+    age = await get_leaderboard_age("month")
+    flight_key = ("month", date.today())
+    degraded = waka_breaker.is_open
+    degraded_note = ""
+
+    # Если данные есть в кэше, читаем только нужные места из sorted set
+    cached = False
+    if age is not None:
+        if chat_id is None:
+            total = await get_leaderboard_size("month")
+            top = await get_top("month", LEADERBOARD_TOP_N) if total else []
+            around = await get_around("month", caller_id, LEADERBOARD_AROUND) if top else []
+            cached = bool(top)
+        else:
+            scores = await get_scores("month", users)
+            top, around, total = rank_leaderboard(scores, caller_id, LEADERBOARD_TOP_N, LEADERBOARD_AROUND)
+            cached = bool(scores)
+        # Если прочитать кэш не удалось, ниже лидерборд строится без него
+
+    if cached:
+        if is_stale("month", age) and not degraded:
+            # Данные устарели: отвечаем ими, а кэш обновляем в фоне одним сбором
+            leaderboard_flight.start(flight_key, rebuild_month_stats)
+        if degraded:
+            degraded_note = format_degraded_note(datetime.now(timezone.utc) - timedelta(seconds=age))
+    elif degraded:
+        # Кэша нет, а WakaTime недоступен: отвечаем сразу по последним загруженным данным, без кэширования
+        if chat_id is None:
+            users = await user_registry.get_users()
+        entries, updated_at = await last_known_entries(users, "month")
+        top, around, total = rank_leaderboard(entries, caller_id, LEADERBOARD_TOP_N, LEADERBOARD_AROUND)
+        degraded_note = format_degraded_note(updated_at)
+    elif chat_id is not None:
+        # Кэша нет: считаем только участников чата, без сохранения неполного лидерборда в кэш
+        status_message = await message.answer("Собираем данные за месяц... Это может занять некоторое время.")
+        entries, failed = await leaderboard_flight.do(
+            ("month", date.today(), chat_id), lambda: build_entries(users, "month")
+        )
+        top, around, total = rank_leaderboard(entries, caller_id, LEADERBOARD_TOP_N, LEADERBOARD_AROUND)
+        try:
+            await status_message.delete()
+        except:
+            pass
     else:
         # Если данных в кэше нет, собираем их обычным способом
-        users = await get_all_users()
+        users = await user_registry.get_users()
         if not users:
             # Изменяем сообщение для групп
             if is_private:
@@ -38,31 +124,25 @@ async def top_month_handler(message: types.Message):
                     f"Для регистрации напишите мне в личные сообщения: https://t.me/{bot_username}"
                 )
             return
-            
+
         # Сообщаем пользователю, что идет сбор данных
         status_message = await message.answer("Собираем данные за месяц... Это может занять некоторое время.")
-        
-        leaderboard = []
-        for tg_id, username, waka_key in users:
-            if not waka_key:
-                continue
-            coding_minutes = await get_coding_time_month(waka_key)
-            leaderboard.append((username, coding_minutes))
-        
-        # Сохраняем данные в кэш
-        save_month_stats(leaderboard)
-        
+
+        # Одновременные запросы при пустом кэше обслуживаются одним сбором
+        entries = await leaderboard_flight.do(flight_key, lambda: rebuild_month_stats(users))
+        top, around, total = rank_leaderboard(entries, caller_id, LEADERBOARD_TOP_N, LEADERBOARD_AROUND)
+
         # Удаляем статусное сообщение
         try:
             await status_message.delete()
         except:
             pass
-    
-    # Сортируем и форматируем результаты
-    leaderboard = sorted(leaderboard, key=lambda x: x[1], reverse=True)
-    lines = ["<b>Топ участников (Coding за месяц):</b>"]
-    
-    for rank, (username, minutes) in enumerate(leaderboard, start=1):
-        lines.append(f"{rank}. {format_username(username)} — {format_time(minutes)}")
-    
-    await message.answer("\n".join(lines), parse_mode="HTML") 
\ No newline at end of file
+
+    lines = format_ranked_lines("<b>Топ участников (Coding за месяц):</b>", top, around, total)
+    if degraded_note:
+        lines.append(degraded_note)
+    scope_note = format_scope_note(chat_id, "month")
+    if scope_note:
+        lines.append(scope_note)
+
+    await message.answer("\n".join(lines), parse_mode="HTML")
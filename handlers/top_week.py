@@ -1,22 +1,38 @@
+from datetime import date
+
 from aiogram import Router, types, F
 from aiogram.filters import Command
-from db import get_all_users
-from wakatime_client import get_coding_time_week
-from utils import format_time, format_username
+from aiogram.filters.command import CommandObject
+from user_registry import user_registry
+from daily_totals import build_leaderboard, last_known_leaderboard
+from circuit_breaker import waka_breaker
+from singleflight import leaderboard_flight
+from utils import format_time, format_username, format_failed_note, leaderboard_chat_id, format_scope_note, format_degraded_note
 
 router = Router()
 
 @router.message(Command("week"))
-async def top_week_handler(message: types.Message):
+async def top_week_handler(message: types.Message, command: CommandObject):
     """
     Формирует лидерборд участников по времени кодинга за последние 7 дней.
     Отображает username как ссылку и время в формате часы и минуты.
-    Работает как в личных сообщениях, так и в группах.
+    Работает как в личных сообщениях, так и в группах: в группе учитываются
+    только участники чата, а с аргументом all — все пользователи.
+    Если предохранитель WakaTime разомкнут, лидерборд строится по последним
+    загруженным данным с пометкой об их возрасте.
     """
-    # Проверяем, не групповой ли это чат и есть ли у пользователя права на просмотр
+    # Личный чат или группа: от этого зависит текст подсказки, если участников нет
     is_private = message.chat.type == "private"
     
-    users = await get_all_users()
+    # В группах лидерборд строится только по участникам чата, "/week all" — по всем
+    chat_id = leaderboard_chat_id(message, command.args)
+    users = await user_registry.get_leaderboard_users(chat_id)
+    if not users and chat_id is not None:
+        await message.answer(
+            "В этом чате пока нет участников с WakaTime API ключом. "
+            "Общий топ: /week all"
+        )
+        return
     if not users:
         # Изменяем сообщение для групп
         if is_private:
@@ -29,17 +45,29 @@ async def top_week_handler(message: types.Message):
             )
         return
         
-    leaderboard = []
-    for tg_id, username, waka_key in users:
-        if not waka_key:
-            continue
-        coding_minutes = await get_coding_time_week(waka_key)
-        leaderboard.append((username, coding_minutes))
+    degraded_note = ""
+    if not waka_breaker.is_open:
+        # Одновременные запросы одного лидерборда обслуживаются одним сбором
+        leaderboard, failed = await leaderboard_flight.do(
+            ("week", date.today(), chat_id), lambda: build_leaderboard(users, "week")
+        )
+    if waka_breaker.is_open:
+        # WakaTime недоступен: сразу отвечаем последними загруженными значениями
+        leaderboard, updated_at = await last_known_leaderboard(users, "week")
+        failed, degraded_note = [], format_degraded_note(updated_at)
     
-    leaderboard.sort(key=lambda x: x[1], reverse=True)
+    leaderboard = sorted(leaderboard, key=lambda x: x[1], reverse=True)
     lines = ["<b>Топ участников (Coding за неделю):</b>"]
     
     for rank, (username, minutes) in enumerate(leaderboard, start=1):
         lines.append(f"{rank}. {format_username(username)} — {format_time(minutes)}")
     
+    # Пользователи с ошибкой запроса помечаются явно, а не показываются с нулём
+    note = format_failed_note(failed) or degraded_note
+    if note:
+        lines.append(note)
+    scope_note = format_scope_note(chat_id, "week")
+    if scope_note:
+        lines.append(scope_note)
+    
     await message.answer("\n".join(lines), parse_mode="HTML") 
\ No newline at end of file
@@ -0,0 +1,90 @@
+"""
+Карантин нерабочих WakaTime ключей.
+
+Отозванный или опечатанный ключ отвечает 401/403 на каждый запрос, поэтому
+без карантина он тратил бы лимит запросов в каждом /day, /week и обновлении
+кэша. Ошибки авторизации подряд считаются в строке users; после
+KEY_QUARANTINE_FAILURES ошибок ключ исключается из сбора до
+key_quarantined_until, а владелец получает личное сообщение. Когда срок
+истекает, ключ снова попадает в сбор и служит проверкой: успех снимает
+карантин, новая ошибка удваивает интервал (до KEY_REPROBE_MAX).
+"""
+import logging
+
+from aiogram import Bot
+
+import db
+from config import API_TOKEN, KEY_QUARANTINE_FAILURES, KEY_REPROBE_BASE, KEY_REPROBE_MAX
+from wakatime_client import AUTH_ERROR_STATUSES, WakaTimeError
+
+# Бот для сообщений владельцам; процессы без бота (планировщик, воркеры) создают своего
+_bot: Bot = None
+_own_bot = False
+
+
+def is_auth_error(error: Exception) -> bool:
+    return isinstance(error, WakaTimeError) and error.status in AUTH_ERROR_STATUSES
+
+
+def set_notifier_bot(bot: Bot):
+    """Использовать для сообщений владельцам уже созданный бот."""
+    global _bot, _own_bot
+    _bot, _own_bot = bot, False
+
+
+async def close_key_health():
+    """Закрывает сессию бота, если он был создан этим модулем."""
+    global _bot, _own_bot
+    if _own_bot and _bot is not None:
+        await _bot.session.close()
+    _bot, _own_bot = None, False
+
+
+async def _notify_owner(telegram_id: int, until):
+    global _bot, _own_bot
+    if _bot is None:
+        _bot, _own_bot = Bot(API_TOKEN, parse_mode="HTML"), True
+    try:
+        await _bot.send_message(
+            telegram_id,
+            "WakaTime не принимает твой API ключ (ошибка авторизации), поэтому твоя статистика "
+            "пока не попадает в лидерборды.\n\n"
+            f"Бот проверит ключ снова после {until:%d.%m.%Y %H:%M} UTC. "
+            "Если ключ отозван или изменился, отправь новый: /setkey &lt;твой API ключ&gt;",
+        )
+    except Exception as e:
+        # Пользователь мог заблокировать бота: карантин от этого не зависит
+        logging.warning(f"Не удалось уведомить пользователя {telegram_id} о карантине ключа: {e}")
+
+
+async def record_key_results(ok_keys, auth_failed_keys):
+    """
+    Учитывает результаты запросов к WakaTime: успехи сбрасывают счётчик ошибок,
+    ошибки авторизации увеличивают его и при достижении порога отправляют ключ
+    на карантин с уведомлением владельца. Ошибки БД только логируются, чтобы
+    не мешать сбору статистики.
+
+    Счётчик хранится только в БД, поэтому успехи сбрасываются в ней для всех
+    ключей: ошибки, накопленные другим процессом или до перезапуска, тоже
+    обнуляются, и правило «N ошибок подряд» соблюдается в любом процессе.
+    """
+    try:
+        if ok_keys:
+            recovered = await db.reset_key_failures(ok_keys)
+            if recovered:
+                logging.info(f"Ключи {recovered} пользователей снова работают, счётчик ошибок сброшен")
+
+        if not auth_failed_keys:
+            return
+        rows = await db.record_key_failures(
+            auth_failed_keys, KEY_QUARANTINE_FAILURES, KEY_REPROBE_BASE, KEY_REPROBE_MAX
+        )
+        for telegram_id, failures, until in rows:
+            if until is None:
+                continue
+            logging.warning(f"Ключ пользователя {telegram_id} на карантине до {until} ({failures} ошибок подряд)")
+            # Владелец узнаёт о карантине один раз, повторные проверки проходят молча
+            if failures == KEY_QUARANTINE_FAILURES:
+                await _notify_owner(telegram_id, until)
+    except Exception as e:
+        logging.error(f"Ошибка учёта состояния WakaTime ключей: {e}")
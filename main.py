@@ -2,8 +2,8 @@ import asyncio
 import logging
 
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
-from config import API_TOKEN, DATABASE_URL
+from aiogram.fsm.storage.redis import RedisStorage
+from config import API_TOKEN, DATABASE_URL, BOT_MODE, FSM_STATE_TTL
 from db import init_db_pool
 from handlers.start import router as start_router
 from handlers.setkey import router as setkey_router
@@ -12,7 +12,13 @@ from handlers.top_week import router as week_router
 from handlers.top_month import router as month_router
 from handlers.top_year import router as year_router
 from handlers.help import router as help_router
-from redis_cache import init_redis
+from handlers.chat_members import router as chat_members_router, track_chat_activity
+from key_health import set_notifier_bot
+from metrics import handler_metrics_middleware, init_metrics_server, close_metrics_server
+from redis_cache import REDIS_URL, init_redis, close_redis
+from user_registry import init_user_registry, close_user_registry
+from wakatime_client import init_wakatime_client, close_wakatime_client
+from webhook import run_webhook
 
 logging.basicConfig(level=logging.INFO)
 
@@ -20,19 +26,38 @@ logging.basicConfig(level=logging.INFO)
 async def main():
     # Инициализируем подключение к базе данных
     await init_db_pool(DATABASE_URL)
+
+    # Пользователи с ключом держатся в памяти и обновляются через LISTEN/NOTIFY
+    await init_user_registry(DATABASE_URL)
     
     # Инициализируем подключение к Redis
-    init_redis()
+    await init_redis()
     
     bot = Bot(API_TOKEN, parse_mode="HTML")
+    # Уведомления о карантине ключей отправляются этим же ботом
+    set_notifier_bot(bot)
     
-    # Удаляем вебхук перед запуском в режиме polling
-    await bot.delete_webhook()
-    
-    # Используем MemoryStorage для хранения состояний FSM
-    storage = MemoryStorage()
+    # Состояния FSM хранятся в Redis: регистрация переживает перезапуск
+    # и продолжается на любой реплике, а брошенная удаляется через FSM_STATE_TTL
+    storage = RedisStorage.from_url(REDIS_URL, state_ttl=FSM_STATE_TTL, data_ttl=FSM_STATE_TTL)
     dp = Dispatcher(storage=storage)
 
+    # Общая HTTP-сессия WakaTime живёт всё время работы бота
+    dp.startup.register(init_wakatime_client)
+    dp.shutdown.register(close_wakatime_client)
+    dp.shutdown.register(close_redis)
+    dp.shutdown.register(close_user_registry)
+
+    # Метрики Prometheus отдаются из того же event loop: в режиме polling на METRICS_PORT,
+    # в режиме webhook — тем же сервером, что принимает обновления
+    if BOT_MODE != "webhook":
+        dp.startup.register(init_metrics_server)
+        dp.shutdown.register(close_metrics_server)
+    dp.message.middleware(handler_metrics_middleware)
+
+    # Состав групп для лидербордов чата: по сообщениям и событиям chat_member
+    dp.message.outer_middleware(track_chat_activity)
+
     # Включаем роутеры
     dp.include_router(start_router)
     dp.include_router(setkey_router)
@@ -41,11 +66,19 @@ async def main():
     dp.include_router(month_router)
     dp.include_router(year_router)
     dp.include_router(help_router)
+    dp.include_router(chat_members_router)
 
     try:
-        logging.info("Бот запущен. Ожидаем сообщений...")
-        await dp.start_polling(bot)
+        if BOT_MODE == "webhook":
+            await run_webhook(dp, bot)
+        else:
+            # Удаляем вебхук перед запуском в режиме polling
+            await bot.delete_webhook()
+            logging.info("Бот запущен. Ожидаем сообщений...")
+            # chat_member приходят, только если запрошены явно
+            await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
     finally:
+        await storage.close()
         await bot.session.close()
 
 
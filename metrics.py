@@ -0,0 +1,189 @@
+"""
+Метрики Prometheus и HTTP-сервер для их отдачи.
+
+Сервер работает в event loop процесса (бота или планировщика) и отдаёт
+метрики по GET /metrics на порту METRICS_PORT.
+"""
+import logging
+import time
+
+from aiohttp import web
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+import db
+from config import METRICS_PORT
+
+# Задержки запросов к WakaTime: от быстрых ответов до годовых выгрузок с повторами
+WAKATIME_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 15, 30, 60)
+# Команды бота: при пустом кэше годовой лидерборд собирается минутами
+HANDLER_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60, 120, 300)
+# Возраст кэша: от минуты до жёсткого срока жизни годового кэша (3 дня)
+CACHE_AGE_BUCKETS = (60, 300, 900, 1800, 3600, 3 * 3600, 6 * 3600, 12 * 3600, 86400, 2 * 86400, 3 * 86400)
+# Длительность фоновых обновлений: от секунд до часа
+REFRESH_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+
+WAKATIME_REQUEST_SECONDS = Histogram(
+    "wakatime_request_seconds",
+    "Длительность одного HTTP-запроса к WakaTime API",
+    ["period", "status"],
+    buckets=WAKATIME_BUCKETS,
+)
+
+WAKATIME_BREAKER_STATE = Gauge(
+    "wakatime_breaker_state",
+    "Состояние предохранителя WakaTime: 0 — замкнут, 1 — пробный запрос, 2 — разомкнут",
+)
+
+HANDLER_SECONDS = Histogram(
+    "bot_handler_seconds",
+    "Время обработки команды бота",
+    ["command"],
+    buckets=HANDLER_BUCKETS,
+)
+
+CACHE_REQUESTS = Counter(
+    "leaderboard_cache_requests_total",
+    "Обращения к кэшу лидербордов: hit, stale (устаревшие данные) или miss",
+    ["period", "result"],
+)
+
+CACHE_AGE_SECONDS = Histogram(
+    "leaderboard_cache_age_seconds",
+    "Возраст лидерборда в кэше в момент чтения",
+    ["period"],
+    buckets=CACHE_AGE_BUCKETS,
+)
+
+RESULT_CACHE_REQUESTS = Counter(
+    "wakatime_result_cache_requests_total",
+    "Чтения кэша посуточных рядов пользователей: memory, redis или miss",
+    ["tier"],
+)
+
+DB_POOL_SIZE = Gauge("db_pool_size", "Открытых соединений в пуле PostgreSQL")
+DB_POOL_IDLE = Gauge("db_pool_idle", "Свободных соединений в пуле PostgreSQL")
+DB_POOL_MAX = Gauge("db_pool_max_size", "Максимальный размер пула PostgreSQL")
+
+# Пул создаётся позже импорта модуля, поэтому значения читаются при каждом сборе метрик
+DB_POOL_SIZE.set_function(lambda: db.db_pool.get_size() if db.db_pool is not None else 0)
+DB_POOL_IDLE.set_function(lambda: db.db_pool.get_idle_size() if db.db_pool is not None else 0)
+DB_POOL_MAX.set_function(lambda: db.db_pool.get_max_size() if db.db_pool is not None else 0)
+
+REFRESH_SECONDS = Histogram(
+    "cache_refresh_seconds",
+    "Длительность задачи обновления кэша",
+    ["job"],
+    buckets=REFRESH_BUCKETS,
+)
+
+REFRESH_USERS = Gauge(
+    "cache_refresh_users",
+    "Пользователи в последнем запуске задачи обновления кэша: total или failed",
+    ["job", "result"],
+)
+
+REFRESH_LAST_SUCCESS = Gauge(
+    "cache_refresh_last_success_timestamp_seconds",
+    "Время последнего успешного сохранения кэша задачей (unix time)",
+    ["job"],
+)
+
+
+def observe_cache(period, age_seconds, stale):
+    """Учитывает чтение кэша лидерборда: age_seconds = None означает промах."""
+    if age_seconds is None:
+        CACHE_REQUESTS.labels(period, "miss").inc()
+        return
+    CACHE_REQUESTS.labels(period, "stale" if stale else "hit").inc()
+    CACHE_AGE_SECONDS.labels(period).observe(age_seconds)
+
+
+class RefreshRun:
+    """
+    Метрики одного запуска задачи обновления кэша.
+
+    Задача заполняет total, failed и saved по ходу работы, а observe()
+    записывает их вместе с длительностью запуска.
+    """
+
+    def __init__(self, job):
+        self.job = job
+        self.started = time.monotonic()
+        self.total = 0
+        self.failed = 0
+        self.saved = False
+
+    def observe(self):
+        REFRESH_SECONDS.labels(self.job).observe(time.monotonic() - self.started)
+        REFRESH_USERS.labels(self.job, "total").set(self.total)
+        REFRESH_USERS.labels(self.job, "failed").set(self.failed)
+        if self.saved:
+            REFRESH_LAST_SUCCESS.labels(self.job).set_to_current_time()
+
+
+# Команды, зарегистрированные в handlers/; остальные попадают в метку "other",
+# чтобы произвольный "/текст" пользователя не создавал новые временные ряды
+KNOWN_COMMANDS = {"start", "register", "setkey", "help", "day", "week", "month", "year"}
+
+
+def command_name(text):
+    """Имя команды из текста сообщения: "/year@bot all" -> "year", "/unknown" -> "other"."""
+    if not text or not text.startswith("/"):
+        return "message"
+    name = text.split(maxsplit=1)[0][1:].split("@", 1)[0].lower()
+    return name if name in KNOWN_COMMANDS else "other"
+
+
+async def handler_metrics_middleware(handler, event, data):
+    """Middleware aiogram: замеряет время обработки сообщения по имени команды."""
+    started = time.perf_counter()
+    try:
+        return await handler(event, data)
+    finally:
+        HANDLER_SECONDS.labels(command_name(getattr(event, "text", None))).observe(time.perf_counter() - started)
+
+
+async def metrics_handler(request):
+    return web.Response(body=generate_latest(), headers={"Content-Type": CONTENT_TYPE_LATEST})
+
+
+def create_metrics_app() -> web.Application:
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler)
+    return app
+
+
+# Запущенный HTTP-сервер метрик, создаётся в init_metrics_server()
+_runner: web.AppRunner = None
+
+
+async def init_metrics_server(port: int = None, host: str = "0.0.0.0"):
+    """
+    Запускает HTTP-сервер метрик в текущем event loop.
+    Порт по умолчанию — METRICS_PORT; при 0 сервер не запускается.
+    Повторный вызов при уже запущенном сервере ничего не делает.
+    """
+    global _runner
+
+    port = METRICS_PORT if port is None else port
+    if _runner is not None or not port:
+        return
+    runner = web.AppRunner(create_metrics_app(), access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except OSError as e:
+        await runner.cleanup()
+        logging.error(f"Не удалось запустить сервер метрик на порту {port}: {e}")
+        return
+    _runner = runner
+    logging.info(f"Метрики доступны на http://{host}:{port}/metrics")
+
+
+async def close_metrics_server():
+    """Останавливает HTTP-сервер метрик."""
+    global _runner
+
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
@@ -0,0 +1,100 @@
+"""
+Ограничение частоты запросов к WakaTime: общий и per-key token bucket
+с адаптивным снижением скорости при ответах 429.
+"""
+import asyncio
+import time
+
+from config import (
+    WAKATIME_RATE,
+    WAKATIME_BURST,
+    WAKATIME_MIN_RATE,
+    WAKATIME_KEY_RATE,
+    WAKATIME_KEY_BURST,
+)
+
+
+class TokenBucket:
+    """
+    Классический token bucket: rate токенов в секунду, не больше capacity.
+    Ожидающие обслуживаются по очереди.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def block_for(self, seconds: float):
+        """Не выдаёт токены ближайшие seconds секунд (например, по Retry-After)."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class RateLimiter:
+    """
+    Общий лимит на процесс плюс отдельный лимит на каждый API ключ.
+
+    Скорость общего лимита адаптивная: каждый 429 уменьшает её вдвое
+    (но не ниже min_rate), каждый успешный ответ понемногу возвращает её
+    к исходному значению.
+    """
+
+    def __init__(self, rate, burst, min_rate, key_rate, key_burst):
+        self.max_rate = rate
+        self.min_rate = min_rate
+        self.key_rate = key_rate
+        self.key_burst = key_burst
+        self.global_bucket = TokenBucket(rate, burst)
+        self._key_buckets = {}
+
+    def _key_bucket(self, key) -> TokenBucket:
+        bucket = self._key_buckets.get(key)
+        if bucket is None:
+            bucket = self._key_buckets[key] = TokenBucket(self.key_rate, self.key_burst)
+        return bucket
+
+    async def acquire(self, key):
+        await self._key_bucket(key).acquire()
+        await self.global_bucket.acquire()
+
+    def on_success(self):
+        bucket = self.global_bucket
+        if bucket.rate < self.max_rate:
+            bucket.rate = min(self.max_rate, bucket.rate + self.max_rate * 0.05)
+
+    def on_throttled(self, key, retry_after: float = None):
+        """Учитывает ответ 429: замедляет общий лимит и при необходимости блокирует ключ."""
+        bucket = self.global_bucket
+        bucket.rate = max(self.min_rate, bucket.rate / 2)
+        if retry_after:
+            self._key_bucket(key).block_for(retry_after)
+
+
+# Общий ограничитель для всех запросов процесса к WakaTime
+waka_limiter = RateLimiter(
+    WAKATIME_RATE,
+    WAKATIME_BURST,
+    WAKATIME_MIN_RATE,
+    WAKATIME_KEY_RATE,
+    WAKATIME_KEY_BURST,
+)
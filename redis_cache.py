@@ -1,11 +1,13 @@
-import json
 import logging
 import os
 import sys
-import redis
 import traceback
 from datetime import datetime
 
+import redis.asyncio as redis
+
+from metrics import observe_cache
+
 # Настройка логирования, если еще не настроено
 if not logging.getLogger().handlers:
     logging.basicConfig(
@@ -18,168 +20,237 @@ if not logging.getLogger().handlers:
 
 # Получаем URL Redis из переменной окружения или используем значение по умолчанию
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "20"))
 logging.info(f"Используем Redis URL: {REDIS_URL}")
 
-# Создаем соединение с Redis
-try:
-    redis_client = redis.from_url(REDIS_URL)
-except Exception as e:
-    logging.error(f"Ошибка создания клиента Redis: {e}\n{traceback.format_exc()}")
-    redis_client = None
+# Асинхронный клиент с пулом соединений, создаётся в init_redis()
+redis_client: redis.Redis = None
+
+# Лидерборды в виде sorted set (member = telegram_id, score = минуты),
+# username участников и время обновления
+# (ключи по telegram_id отличаются от прежних по username, чтобы не читать старый формат)
+LEADERBOARD_KEY = "wakatime:lb:{period}:ids"
+LEADERBOARD_NAMES_KEY = "wakatime:lb:{period}:names"
+LEADERBOARD_UPDATED_KEY = "wakatime:lb:{period}:updated_at"
+
+# Мягкое время жизни кэша в секундах: после него данные считаются устаревшими,
+# но ещё отдаются пользователю, пока в фоне идёт обновление
+MONTH_CACHE_SOFT_TTL = 3600  # 1 час
+YEAR_CACHE_SOFT_TTL = 86400  # 24 часа
+
+# Жёсткое время жизни кэша в секундах: после него ключ удаляется из Redis
+MONTH_CACHE_TTL = 6 * 3600  # 6 часов
+YEAR_CACHE_TTL = 3 * 86400  # 3 дня
+
 
-# Ключи для кэша
-MONTH_CACHE_KEY = "wakatime:month_stats"
-YEAR_CACHE_KEY = "wakatime:year_stats"
+# Мягкое время жизни по периодам лидербордов
+LEADERBOARD_SOFT_TTLS = {
+    "month": MONTH_CACHE_SOFT_TTL,
+    "year": YEAR_CACHE_SOFT_TTL,
+}
 
-# Время жизни кэша в секундах
-MONTH_CACHE_TTL = 3600  # 1 час
-YEAR_CACHE_TTL = 86400  # 24 часа
 
-def init_redis():
-    """Проверяем соединение с Redis и логируем результат"""
+async def init_redis():
+    """
+    Создаёт пул соединений с Redis и один раз проверяет соединение.
+    Повторный вызов при уже созданном клиенте ничего не делает.
+    """
     global redis_client
-    
-    # Если клиент не инициализирован, пробуем создать заново
-    if redis_client is None:
-        try:
-            redis_client = redis.from_url(REDIS_URL)
-        except Exception as e:
-            logging.error(f"Ошибка создания клиента Redis: {e}\n{traceback.format_exc()}")
-            return False
-    
-    # Проверяем соединение
-    try:
-        redis_client.ping()
-        logging.info(f"Успешное подключение к Redis: {REDIS_URL}")
+
+    if redis_client is not None:
         return True
-    except redis.RedisError as e:
+
+    try:
+        pool = redis.ConnectionPool.from_url(REDIS_URL, max_connections=REDIS_MAX_CONNECTIONS)
+        client = redis.Redis(connection_pool=pool)
+        await client.ping()
+    except Exception as e:
         logging.error(f"Ошибка подключения к Redis: {e}\n{traceback.format_exc()}")
         return False
 
-def save_month_stats(stats_data):
-    """
-    Сохраняет статистику за месяц в Redis
-    
-    Args:
-        stats_data: Список кортежей (username, minutes)
-    """
-    if not init_redis():
+    redis_client = client
+    logging.info(f"Успешное подключение к Redis: {REDIS_URL}")
+    return True
+
+
+async def close_redis():
+    """Закрывает клиент и пул соединений с Redis."""
+    global redis_client
+
+    if redis_client is not None:
+        await redis_client.close()
+        await redis_client.connection_pool.disconnect()
+        redis_client = None
+
+
+async def _save_stats(ttl, stats_data, label, period):
+    if redis_client is None:
         logging.error("Redis не инициализирован. Невозможно сохранить данные.")
         return False
-        
-    data_to_save = {
-        "timestamp": datetime.now().isoformat(),
-        "data": [(username, float(minutes)) for username, minutes in stats_data]
-    }
+
+    now = datetime.now()
+    lb_key = LEADERBOARD_KEY.format(period=period)
+    names_key = LEADERBOARD_NAMES_KEY.format(period=period)
+    tmp_key = f"{lb_key}:tmp"
+    tmp_names_key = f"{names_key}:tmp"
+    # Участники без username (только /setkey, без контакта) тоже попадают в лидерборд
+    scores = {str(tg_id): float(minutes) for tg_id, _, minutes in stats_data}
+    names = {str(tg_id): username or "" for tg_id, username, _ in stats_data}
     try:
-        redis_client.setex(
-            MONTH_CACHE_KEY, 
-            MONTH_CACHE_TTL, 
-            json.dumps(data_to_save, ensure_ascii=False)
-        )
-        logging.info(f"Месячная статистика обновлена в кэше, {len(stats_data)} записей")
+        # Sorted set и имена заменяются атомарно в одной транзакции
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.delete(tmp_key, tmp_names_key)
+            if scores:
+                pipe.zadd(tmp_key, scores)
+                pipe.hset(tmp_names_key, mapping=names)
+                pipe.rename(tmp_key, lb_key)
+                pipe.rename(tmp_names_key, names_key)
+                pipe.expire(lb_key, ttl)
+                pipe.expire(names_key, ttl)
+            else:
+                pipe.delete(lb_key, names_key)
+            pipe.setex(LEADERBOARD_UPDATED_KEY.format(period=period), ttl, now.timestamp())
+            await pipe.execute()
+        logging.info(f"Статистика {label} обновлена в кэше, {len(stats_data)} записей")
         return True
     except Exception as e:
-        logging.error(f"Ошибка при сохранении месячной статистики: {e}\n{traceback.format_exc()}")
+        logging.error(f"Ошибка при сохранении статистики {label}: {e}\n{traceback.format_exc()}")
         return False
 
-def get_month_stats():
+
+async def save_month_stats(stats_data):
     """
-    Получает статистику за месяц из Redis
-    
-    Returns:
-        Список кортежей (username, minutes) или None, если кэш отсутствует
+    Сохраняет статистику за месяц в Redis
+
+    Args:
+        stats_data: Список кортежей (telegram_id, username, minutes)
+    """
+    return await _save_stats(MONTH_CACHE_TTL, stats_data, "за месяц", "month")
+
+
+async def save_year_stats(stats_data):
+    """
+    Сохраняет статистику за год в Redis
+
+    Args:
+        stats_data: Список кортежей (telegram_id, username, minutes)
+    """
+    return await _save_stats(YEAR_CACHE_TTL, stats_data, "за год", "year")
+
+
+def _decode(member):
+    return member.decode() if isinstance(member, bytes) else member
+
+
+async def _with_names(period, entries):
+    """Подставляет username участников вместо telegram_id: [(rank, member, score)] -> [(rank, username, minutes)]."""
+    if not entries:
+        return []
+    names = await redis_client.hmget(LEADERBOARD_NAMES_KEY.format(period=period), [member for _, member, _ in entries])
+    return [(rank, _decode(name) or None, score) for (rank, _, score), name in zip(entries, names)]
+
+
+async def get_leaderboard_age(period):
+    """
+    Возвращает возраст лидерборда периода в секундах или None, если его нет в кэше.
+    Каждый вызов учитывается в метриках попаданий в кэш.
     """
-    if not init_redis():
+    if redis_client is None:
         logging.error("Redis не инициализирован. Невозможно получить данные.")
+        observe_cache(period, None, False)
         return None
-        
     try:
-        data = redis_client.get(MONTH_CACHE_KEY)
-        if not data:
-            logging.warning("Кэш месячной статистики не найден")
-            return None
-        
-        parsed_data = json.loads(data)
-        timestamp = datetime.fromisoformat(parsed_data["timestamp"])
-        stats = parsed_data["data"]
-        
-        # Убедимся, что вернулся корректный формат данных
-        if not stats or not isinstance(stats, list):
-            logging.error(f"Неверный формат данных в кэше месячной статистики: {stats}")
-            return None
-            
-        # Преобразуем JSON данные обратно в кортежи с числовыми значениями
-        stats = [(username, float(minutes)) for username, minutes in stats]
-        
-        age_seconds = (datetime.now() - timestamp).total_seconds()
-        logging.info(f"Данные из кэша за месяц получены, возраст: {age_seconds:.1f} сек, записей: {len(stats)}")
-        
-        return stats
+        updated_at = await redis_client.get(LEADERBOARD_UPDATED_KEY.format(period=period))
     except Exception as e:
-        logging.error(f"Ошибка при получении месячной статистики из кэша: {e}\n{traceback.format_exc()}")
+        logging.error(f"Ошибка при получении времени обновления лидерборда {period}: {e}")
+        updated_at = None
+    if updated_at is None:
+        observe_cache(period, None, False)
         return None
+    age = max(0.0, datetime.now().timestamp() - float(updated_at))
+    observe_cache(period, age, is_stale(period, age))
+    return age
 
-def save_year_stats(stats_data):
+
+def is_stale(period, age_seconds):
+    """Устарел ли лидерборд периода с возрастом age_seconds (мягкое время жизни истекло)."""
+    return age_seconds >= LEADERBOARD_SOFT_TTLS[period]
+
+
+async def get_top(period, limit):
     """
-    Сохраняет статистику за год в Redis
-    
-    Args:
-        stats_data: Список кортежей (username, minutes)
+    Возвращает первые limit мест лидерборда через ZREVRANGE.
+
+    Returns:
+        Список кортежей (rank, username, minutes), rank начинается с 1;
+        пустой список, если лидерборд недоступен
     """
-    if not init_redis():
-        logging.error("Redis не инициализирован. Невозможно сохранить данные.")
-        return False
-        
-    data_to_save = {
-        "timestamp": datetime.now().isoformat(),
-        "data": [(username, float(minutes)) for username, minutes in stats_data]
-    }
+    if redis_client is None:
+        logging.error("Redis не инициализирован. Невозможно получить данные.")
+        return []
     try:
-        redis_client.setex(
-            YEAR_CACHE_KEY, 
-            YEAR_CACHE_TTL, 
-            json.dumps(data_to_save, ensure_ascii=False)
-        )
-        logging.info(f"Годовая статистика обновлена в кэше, {len(stats_data)} записей")
-        return True
+        entries = await redis_client.zrevrange(LEADERBOARD_KEY.format(period=period), 0, limit - 1, withscores=True)
+        return await _with_names(period, [(rank, member, score) for rank, (member, score) in enumerate(entries, start=1)])
     except Exception as e:
-        logging.error(f"Ошибка при сохранении годовой статистики: {e}\n{traceback.format_exc()}")
-        return False
+        logging.error(f"Ошибка при получении первых мест лидерборда {period}: {e}")
+        return []
 
-def get_year_stats():
+
+async def get_around(period, telegram_id, radius):
     """
-    Получает статистику за год из Redis
-    
+    Возвращает участников вокруг пользователя: radius мест выше и ниже.
+
     Returns:
-        Список кортежей (username, minutes) или None, если кэш отсутствует
+        Список кортежей (rank, username, minutes) или пустой список,
+        если пользователя нет или лидерборд недоступен
     """
-    if not init_redis():
+    if redis_client is None:
         logging.error("Redis не инициализирован. Невозможно получить данные.")
-        return None
-        
+        return []
+    key = LEADERBOARD_KEY.format(period=period)
+    try:
+        rank = await redis_client.zrevrank(key, str(telegram_id))
+        if rank is None:
+            return []
+        start = max(0, rank - radius)
+        entries = await redis_client.zrevrange(key, start, rank + radius, withscores=True)
+        return await _with_names(period, [(start + i + 1, member, score) for i, (member, score) in enumerate(entries)])
+    except Exception as e:
+        logging.error(f"Ошибка при получении места {telegram_id} в лидерборде {period}: {e}")
+        return []
+
+
+async def get_scores(period, users):
+    """
+    Возвращает минуты указанных пользователей из лидерборда периода одним ZMSCORE.
+
+    Args:
+        users: Список кортежей (telegram_id, username, wakatime_key)
+
+    Returns:
+        Список кортежей (telegram_id, username, minutes) для пользователей, которые есть
+        в лидерборде; пустой список, если лидерборд недоступен
+    """
+    if not users:
+        return []
+    if redis_client is None:
+        logging.error("Redis не инициализирован. Невозможно получить данные.")
+        return []
+    try:
+        scores = await redis_client.zmscore(LEADERBOARD_KEY.format(period=period), [str(tg_id) for tg_id, _, _ in users])
+    except Exception as e:
+        logging.error(f"Ошибка при получении времени участников из лидерборда {period}: {e}")
+        return []
+    return [(tg_id, username, score) for (tg_id, username, _), score in zip(users, scores) if score is not None]
+
+
+async def get_leaderboard_size(period):
+    """Количество участников в лидерборде периода (ZCARD); 0, если лидерборд недоступен."""
+    if redis_client is None:
+        logging.error("Redis не инициализирован. Невозможно получить данные.")
+        return 0
     try:
-        data = redis_client.get(YEAR_CACHE_KEY)
-        if not data:
-            logging.warning("Кэш годовой статистики не найден")
-            return None
-        
-        parsed_data = json.loads(data)
-        timestamp = datetime.fromisoformat(parsed_data["timestamp"])
-        stats = parsed_data["data"]
-        
-        # Убедимся, что вернулся корректный формат данных
-        if not stats or not isinstance(stats, list):
-            logging.error(f"Неверный формат данных в кэше годовой статистики: {stats}")
-            return None
-        
-        # Преобразуем JSON данные обратно в кортежи с числовыми значениями
-        stats = [(username, float(minutes)) for username, minutes in stats]
-        
-        age_seconds = (datetime.now() - timestamp).total_seconds()
-        logging.info(f"Данные из кэша за год получены, возраст: {age_seconds:.1f} сек, записей: {len(stats)}")
-        
-        return stats
+        return await redis_client.zcard(LEADERBOARD_KEY.format(period=period))
     except Exception as e:
-        logging.error(f"Ошибка при получении годовой статистики из кэша: {e}\n{traceback.format_exc()}")
-        return None 
\ No newline at end of file
+        logging.error(f"Ошибка при получении размера лидерборда {period}: {e}")
+        return 0
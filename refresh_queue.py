@@ -0,0 +1,273 @@
+"""
+Распределённое обновление посуточных итогов через Redis Streams.
+
+Задача обновления кэша (координатор) публикует по сообщению на пользователя
+в поток wakatime:refresh:tasks. Процессы refresh_worker.py читают его через
+группу потребителей, загружают дни пользователя в daily_totals, подтверждают
+сообщение (XACK) и отмечают результат в hash задания. Координатор дожидается
+отметок всех пользователей, после чего лидерборд собирается по daily_totals
+(reduce) как и при локальной загрузке.
+
+Ошибки повторяются до REFRESH_TASK_RETRIES раз, после чего сообщение
+переносится в поток wakatime:refresh:dead. Сообщения упавшего воркера,
+не подтверждённые за REFRESH_TASK_VISIBILITY секунд, забирают другие воркеры.
+"""
+import asyncio
+import logging
+import os
+import socket
+import time
+import traceback
+import uuid
+from datetime import date, datetime
+
+import redis.asyncio as redis
+
+import redis_cache
+from config import (
+    REFRESH_DISTRIBUTED,
+    REFRESH_TASK_RETRIES,
+    REFRESH_TASK_VISIBILITY,
+    REFRESH_JOB_TIMEOUT,
+    REFRESH_WORKER_CONCURRENCY,
+    WAKATIME_TIMEOUT,
+)
+from daily_totals import ingest_daily_totals, ingestion_plan, ingest_user
+from db import get_wakatime_key
+from key_health import is_auth_error, record_key_results
+
+TASKS_STREAM = "wakatime:refresh:tasks"
+DEAD_STREAM = "wakatime:refresh:dead"
+GROUP = "refresh-workers"
+# Отметки пользователей задания: telegram_id -> ok или failed
+JOB_KEY = "wakatime:refresh:job:{job_id}"
+
+# Приблизительные ограничения длины потоков (XADD MAXLEN ~)
+TASKS_MAXLEN = 100000
+DEAD_MAXLEN = 10000
+JOB_TTL = 86400
+# Наибольшая пауза воркера между попытками чтения при ошибках Redis, сек
+READ_BACKOFF_MAX = 30.0
+
+
+def _text(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+async def ensure_group(client):
+    """Создаёт поток и группу потребителей, если их ещё нет."""
+    try:
+        await client.xgroup_create(TASKS_STREAM, GROUP, id="0", mkstream=True)
+    except redis.ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+async def distributed_ingest(users, period):
+    """
+    Догружает посуточные итоги силами воркеров и ждёт завершения.
+
+    Returns:
+        Кортеж (ingested, failed) — как у ingest_daily_totals
+    """
+    client = redis_cache.redis_client
+    if client is None:
+        logging.warning("Redis не инициализирован, посуточные итоги загружаются в текущем процессе")
+        return await ingest_daily_totals(users, period=period)
+    await ensure_group(client)
+
+    today = datetime.now().date()
+    plan = await ingestion_plan(users, today)
+    if not plan:
+        return 0, []
+    usernames = {str(tg_id): username for tg_id, username, waka_key, start in plan}
+
+    job_id = uuid.uuid4().hex
+    job_key = JOB_KEY.format(job_id=job_id)
+    # Ключи в поток не попадают: воркер читает ключ пользователя из БД
+    async with client.pipeline(transaction=False) as pipe:
+        for tg_id, username, waka_key, start in plan:
+            pipe.xadd(
+                TASKS_STREAM,
+                {
+                    "job": job_id,
+                    "telegram_id": tg_id,
+                    "start": start.isoformat(),
+                    "end": today.isoformat(),
+                    "period": period,
+                    "attempt": 0,
+                },
+                maxlen=TASKS_MAXLEN,
+                approximate=True,
+            )
+        await pipe.execute()
+    logging.info(f"Задание {job_id}: опубликовано {len(plan)} задач для воркеров")
+
+    deadline = time.monotonic() + REFRESH_JOB_TIMEOUT
+    while time.monotonic() < deadline:
+        if await client.hlen(job_key) >= len(plan):
+            break
+        await asyncio.sleep(1)
+    else:
+        logging.error(f"Задание {job_id}: воркеры не успели за {REFRESH_JOB_TIMEOUT} сек")
+
+    statuses = {_text(k): _text(v) for k, v in (await client.hgetall(job_key)).items()}
+    await client.delete(job_key)
+    # Пользователи без отметки (таймаут) считаются неудавшимися
+    failed = [username for tg_id, username in usernames.items() if statuses.get(tg_id) != "ok"]
+    ingested = len(plan) - len(failed)
+    logging.info(f"Задание {job_id}: посуточные итоги обновлены для {ingested} из {len(plan)} пользователей")
+    return ingested, failed
+
+
+async def refresh_ingest(users, period, jitter=0):
+    """
+    Догружает посуточные итоги для задачи обновления кэша:
+    через воркеры при REFRESH_DISTRIBUTED, иначе в текущем процессе.
+    Разброс запросов jitter применяется только к локальной загрузке.
+    """
+    if REFRESH_DISTRIBUTED:
+        return await distributed_ingest(users, period)
+    return await ingest_daily_totals(users, jitter=jitter, period=period)
+
+
+class RefreshWorker:
+    """
+    Воркер группы потребителей: обрабатывает до concurrency сообщений одновременно.
+    """
+
+    def __init__(self, concurrency: int = None, name: str = None):
+        self.concurrency = concurrency or REFRESH_WORKER_CONCURRENCY
+        self.name = name or f"{socket.gethostname()}-{os.getpid()}"
+        self._stopped = asyncio.Event()
+        self._running = set()
+
+    def stop(self):
+        self._stopped.set()
+
+    async def _finish(self, client, message_id, fields, status, error=None):
+        """Отмечает результат пользователя, при окончательной ошибке переносит сообщение в DEAD_STREAM."""
+        job_key = JOB_KEY.format(job_id=fields["job"])
+        async with client.pipeline(transaction=True) as pipe:
+            if status == "failed":
+                pipe.xadd(DEAD_STREAM, dict(fields, error=error or ""), maxlen=DEAD_MAXLEN, approximate=True)
+            pipe.hset(job_key, fields["telegram_id"], status)
+            pipe.expire(job_key, JOB_TTL)
+            pipe.xack(TASKS_STREAM, GROUP, message_id)
+            pipe.xdel(TASKS_STREAM, message_id)
+            await pipe.execute()
+
+    async def _retry(self, client, message_id, fields):
+        """Публикует задачу заново с увеличенным счётчиком попыток и подтверждает старую."""
+        async with client.pipeline(transaction=True) as pipe:
+            pipe.xadd(TASKS_STREAM, dict(fields, attempt=int(fields["attempt"]) + 1), maxlen=TASKS_MAXLEN, approximate=True)
+            pipe.xack(TASKS_STREAM, GROUP, message_id)
+            pipe.xdel(TASKS_STREAM, message_id)
+            await pipe.execute()
+
+    async def handle(self, client, message_id, raw_fields):
+        message_id = _text(message_id)
+        fields = {_text(k): _text(v) for k, v in raw_fields.items()}
+        tg_id = int(fields["telegram_id"])
+        try:
+            waka_key = await get_wakatime_key(tg_id)
+            if not waka_key:
+                # Ключ удалён после публикации задачи: повторять бессмысленно
+                await self._finish(client, message_id, fields, "failed", "no key")
+                return
+            await asyncio.wait_for(
+                ingest_user(
+                    tg_id,
+                    waka_key,
+                    date.fromisoformat(fields["start"]),
+                    date.fromisoformat(fields["end"]),
+                    fields["period"],
+                ),
+                WAKATIME_TIMEOUT,
+            )
+        except Exception as e:
+            error = repr(e)
+            if is_auth_error(e):
+                # Ключ не принят: повтор не поможет, ключ учитывается для карантина
+                await record_key_results([], [waka_key])
+                logging.error(f"Задача {message_id} ({tg_id}): ключ не принят WakaTime: {error}")
+                await self._finish(client, message_id, fields, "failed", error)
+            elif int(fields["attempt"]) + 1 < REFRESH_TASK_RETRIES:
+                logging.warning(f"Задача {message_id} ({tg_id}) не выполнена: {error}, повторяем")
+                await self._retry(client, message_id, fields)
+            else:
+                logging.error(f"Задача {message_id} ({tg_id}) не выполнена после {REFRESH_TASK_RETRIES} попыток: {error}")
+                await self._finish(client, message_id, fields, "failed", error)
+            return
+        await record_key_results([waka_key], [])
+        await self._finish(client, message_id, fields, "ok")
+
+    def _spawn(self, client, message_id, fields):
+        task = asyncio.create_task(self._handle_safe(client, message_id, fields))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _handle_safe(self, client, message_id, fields):
+        try:
+            await self.handle(client, message_id, fields)
+        except Exception as e:
+            # Сообщение остаётся неподтверждённым и будет забрано повторно
+            logging.error(f"Ошибка обработки задачи {_text(message_id)}: {e}\n{traceback.format_exc()}")
+
+    async def _claim_stale(self, client, count):
+        """Забирает сообщения, которые другие воркеры не подтвердили вовремя."""
+        reply = await client.xautoclaim(
+            TASKS_STREAM, GROUP, self.name, int(REFRESH_TASK_VISIBILITY * 1000), start_id="0-0", count=count
+        )
+        messages = reply[1]
+        if messages:
+            logging.warning(f"Забрано {len(messages)} зависших задач")
+        return [(message_id, fields) for message_id, fields in messages if fields]
+
+    async def _backoff(self, delay):
+        """Ждёт delay секунд или до остановки воркера."""
+        try:
+            await asyncio.wait_for(self._stopped.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
+    async def run(self):
+        client = redis_cache.redis_client
+        logging.info(f"Воркер {self.name} запущен, до {self.concurrency} задач одновременно")
+
+        last_claim = 0.0
+        group_ready = False
+        backoff = 0.0
+        while not self._stopped.is_set():
+            free = self.concurrency - len(self._running)
+            if free <= 0:
+                await asyncio.wait(self._running, return_when=asyncio.FIRST_COMPLETED)
+                continue
+
+            try:
+                if not group_ready:
+                    await ensure_group(client)
+                    group_ready = True
+                messages = []
+                if time.monotonic() - last_claim >= REFRESH_TASK_VISIBILITY / 2:
+                    last_claim = time.monotonic()
+                    messages = await self._claim_stale(client, free)
+                if not messages:
+                    reply = await client.xreadgroup(GROUP, self.name, {TASKS_STREAM: ">"}, count=free, block=1000)
+                    messages = reply[0][1] if reply else []
+            except Exception as e:
+                # Сбой Redis не останавливает воркер: ждём и пробуем снова,
+                # группа пересоздаётся на случай, если Redis перезапустился без данных
+                backoff = min(READ_BACKOFF_MAX, backoff * 2 or 1.0)
+                group_ready = False
+                logging.error(f"Ошибка чтения задач из Redis: {e}, повтор через {backoff:.0f} сек")
+                await self._backoff(backoff)
+                continue
+            backoff = 0.0
+
+            for message_id, fields in messages:
+                self._spawn(client, message_id, fields)
+
+        if self._running:
+            logging.info(f"Ожидаем завершения {len(self._running)} задач...")
+            await asyncio.gather(*self._running, return_exceptions=True)
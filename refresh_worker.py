@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Воркер распределённого обновления кэша.
+Обрабатывает задачи пользователей из Redis Stream (см. refresh_queue.py);
+для ускорения обновления запускается несколько процессов.
+"""
+import asyncio
+import logging
+import signal
+import sys
+
+from config import DATABASE_URL
+from db import init_db_pool, close_db_pool
+from key_health import close_key_health
+from metrics import init_metrics_server, close_metrics_server
+from redis_cache import init_redis, close_redis
+from refresh_queue import RefreshWorker
+from wakatime_client import init_wakatime_client, close_wakatime_client
+
+# Настройка логирования
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.StreamHandler(sys.stdout)
+    ]
+)
+
+
+async def main():
+    await init_db_pool(DATABASE_URL)
+    if not await init_redis():
+        logging.error("Не удалось подключиться к Redis. Воркер не запущен.")
+        return
+    await init_wakatime_client()
+    await init_metrics_server()
+
+    worker = RefreshWorker()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, worker.stop)
+
+    try:
+        await worker.run()
+    finally:
+        await close_metrics_server()
+        await close_key_health()
+        await close_wakatime_client()
+        await close_redis()
+        await close_db_pool()
+        logging.info("Воркер остановлен")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
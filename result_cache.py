@@ -0,0 +1,194 @@
+"""
+Двухуровневый кэш посуточных рядов WakaTime отдельных пользователей.
+
+Первый уровень — ограниченный LRU в памяти процесса, второй — Redis,
+общий для бота и планировщика. Ключ строится по хешу API ключа
+(сам ключ в Redis не попадает) и диапазону дат.
+
+Кэшируются только свежие дни — последние DAILY_TOTALS_REFETCH_DAYS (сегодня
+и вчера) — со сроком жизни, зависящим от периода. Неизменная история
+хранится в таблице daily_totals, и лидерборды за неделю, месяц и год
+читают её оттуда, поэтому второй копии истории в Redis нет.
+
+Записи в Redis кодируются cache_codec (CACHE_CODEC), прежние JSON-записи
+читаются без миграции.
+"""
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from datetime import date, timedelta
+
+import redis_cache
+from cache_codec import decode_series, encode_series
+from config import CACHE_CODEC, DAILY_TOTALS_REFETCH_DAYS, RESULT_CACHE_ENABLED, RESULT_CACHE_SIZE
+from metrics import RESULT_CACHE_REQUESTS
+
+# Свежие дни пользователя: диапазон start..end
+RESULT_KEY = "wakatime:result:{key_hash}:{start}:{end}"
+
+# Срок жизни свежих дней в секундах по периодам: чем длиннее период,
+# тем меньше доля сегодняшнего дня в итоге и тем дольше можно не перезапрашивать
+RESULT_CACHE_TTLS = {
+    "day": 60,
+    "week": 300,
+    "month": 900,
+    "year": 1800,
+}
+DEFAULT_RESULT_TTL = 60
+
+
+def key_hash(waka_key: str) -> str:
+    return hashlib.sha256(waka_key.encode()).hexdigest()[:32]
+
+
+def is_live_range(start: date, end: date, today: date = None) -> bool:
+    """Лежит ли диапазон целиком в свежих днях, которые ещё могут меняться."""
+    live_start = (today or date.today()) - timedelta(days=DAILY_TOTALS_REFETCH_DAYS - 1)
+    return start >= live_start
+
+
+class LRUCache:
+    """
+    Ограниченный по размеру LRU, хранящий вместе со значением время его записи.
+
+    Срок жизни задаёт читатель: запись, общая для нескольких периодов,
+    отдаётся каждому, только пока она моложе его собственного срока.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+
+    def get(self, key, ttl: float = None):
+        """Значение, если оно есть и записано не раньше ttl секунд назад (None — без срока)."""
+        item = self._items.get(key)
+        if item is None:
+            return None
+        written_at, value = item
+        if ttl is not None and time.time() - written_at >= ttl:
+            return None
+        self._items.move_to_end(key)
+        return value
+
+    def set(self, key, value, written_at: float = None):
+        if self.maxsize <= 0:
+            return
+        written_at = time.time() if written_at is None else written_at
+        item = self._items.get(key)
+        if item is not None and item[0] > written_at:
+            # В памяти уже более свежая запись, чем прочитанная из Redis
+            return
+        self._items[key] = (written_at, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def __len__(self):
+        return len(self._items)
+
+
+class ResultCache:
+    """
+    Кэш свежих дней пользователей: LRU процесса перед Redis.
+
+    prefetch() загружает записи многих пользователей из Redis за один
+    запрос (MGET), get() затем обслуживается из памяти. Запись put()
+    уходит в Redis одним SETEX. Диапазоны, задевающие историю, не кэшируются:
+    их дни загружаются в daily_totals один раз.
+    """
+
+    def __init__(self, maxsize: int):
+        self.lru = LRUCache(maxsize)
+
+    @staticmethod
+    def _live_key(h, start, end):
+        return RESULT_KEY.format(key_hash=h, start=start.isoformat(), end=end.isoformat())
+
+    def _remember_live(self, key, payload):
+        # Время записи берётся из Redis, поэтому срок жизни считается от него
+        written_at, series = decode_series(payload)
+        self.lru.set(key, series, written_at)
+
+    async def _load(self, keys, ttl):
+        """Загружает из Redis недостающие в LRU записи одним MGET."""
+        client = redis_cache.redis_client
+        if client is None:
+            return
+        keys = sorted({key for key in keys if self.lru.get(key, ttl) is None})
+        if not keys:
+            return
+        try:
+            payloads = await client.mget(keys)
+        except Exception as e:
+            logging.warning(f"Не удалось прочитать кэш рядов WakaTime из Redis: {e}")
+            return
+        for key, payload in zip(keys, payloads):
+            if payload is None:
+                continue
+            try:
+                self._remember_live(key, payload)
+            except ValueError as e:
+                # Запись неизвестного формата (например, более новой версии) считается промахом
+                logging.warning(f"Не удалось декодировать запись кэша {key}: {e}")
+
+    async def prefetch(self, requests, period: str):
+        """
+        Загружает в память записи многих пользователей одним запросом к Redis.
+
+        Args:
+            requests: Список кортежей (waka_key, start, end)
+            period: Период для выбора срока жизни свежих дней
+        """
+        if not RESULT_CACHE_ENABLED:
+            return
+        today = date.today()
+        keys = [
+            self._live_key(key_hash(waka_key), start, end)
+            for waka_key, start, end in requests
+            if waka_key and is_live_range(start, end, today)
+        ]
+        await self._load(keys, RESULT_CACHE_TTLS.get(period, DEFAULT_RESULT_TTL))
+
+    async def get(self, waka_key: str, start: date, end: date, period: str):
+        """
+        Возвращает закэшированный ряд пользователя [(день, секунды), ...]
+        или None, если его нет в кэше или диапазон задевает историю.
+        """
+        if not RESULT_CACHE_ENABLED or not is_live_range(start, end):
+            return None
+        key = self._live_key(key_hash(waka_key), start, end)
+        ttl = RESULT_CACHE_TTLS.get(period, DEFAULT_RESULT_TTL)
+        series = self.lru.get(key, ttl)
+        if series is not None:
+            RESULT_CACHE_REQUESTS.labels("memory").inc()
+            return series
+
+        await self._load([key], ttl)
+        series = self.lru.get(key, ttl)
+        RESULT_CACHE_REQUESTS.labels("redis" if series is not None else "miss").inc()
+        return series
+
+    async def put(self, waka_key: str, start: date, end: date, period: str, series):
+        """
+        Сохраняет ряд свежих дней пользователя в оба уровня кэша.
+        Ключ в Redis живёт RESULT_CACHE_TTLS[period], а из памяти запись
+        отдаётся по сроку жизни периода читателя.
+        """
+        if not RESULT_CACHE_ENABLED or not is_live_range(start, end):
+            return
+        key = self._live_key(key_hash(waka_key), start, end)
+        ttl = RESULT_CACHE_TTLS.get(period, DEFAULT_RESULT_TTL)
+        written_at = time.time()
+        self.lru.set(key, series, written_at)
+
+        client = redis_cache.redis_client
+        if client is None:
+            return
+        try:
+            await client.setex(key, ttl, encode_series(written_at, series, CACHE_CODEC))
+        except Exception as e:
+            logging.warning(f"Не удалось сохранить ряд WakaTime в Redis: {e}")
+
+
+result_cache = ResultCache(RESULT_CACHE_SIZE)
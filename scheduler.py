@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Долгоживущий планировщик обновления кэша статистики.
+Заменяет bash-цикл в supervisor: подключения к БД, Redis и WakaTime
+создаются один раз и остаются открытыми между запусками задач.
+"""
+import asyncio
+import logging
+import signal
+import sys
+import time
+import traceback
+from datetime import datetime, timedelta
+
+from config import DATABASE_URL, REFRESH_JITTER
+from db import init_db_pool, close_db_pool
+from key_health import close_key_health
+from metrics import init_metrics_server, close_metrics_server
+from redis_cache import init_redis, close_redis
+from wakatime_client import init_wakatime_client, close_wakatime_client
+from update_caches import update_caches
+from update_month_cache import update_month_cache
+
+# Настройка логирования
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.StreamHandler(sys.stdout)
+    ]
+)
+
+
+def parse_cron_field(spec: str, min_value: int, max_value: int):
+    """
+    Разбирает поле cron-выражения в множество допустимых значений.
+
+    Поддерживаются "*", "*/n", число, диапазон "a-b" и списки через запятую.
+    """
+    values = set()
+    for part in spec.split(","):
+        part = part.strip()
+        step = 1
+        if "/" in part:
+            part, step_str = part.split("/", 1)
+            step = int(step_str)
+        if part == "*":
+            start, end = min_value, max_value
+        elif "-" in part:
+            start, end = (int(v) for v in part.split("-", 1))
+        else:
+            start = end = int(part)
+        if start < min_value or end > max_value or start > end or step < 1:
+            raise ValueError(f"Некорректное поле cron: {spec}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronJob:
+    """
+    Задача планировщика с расписанием в стиле cron (минуты и часы).
+
+    Args:
+        name: Имя задачи для логов
+        func: Корутина без аргументов
+        minute: Поле минут, например "0" или "*/15"
+        hour: Поле часов, например "*" или "0"
+        run_on_start: Запустить задачу сразу при старте планировщика
+        group: Группа задач, которые не выполняются одновременно, например
+            все обновления кэша, нагружающие WakaTime одними и теми же ключами
+    """
+
+    def __init__(self, name, func, minute="*", hour="*", run_on_start=False, group=None):
+        self.name = name
+        self.group = group
+        self.func = func
+        self.minutes = parse_cron_field(minute, 0, 59)
+        self.hours = parse_cron_field(hour, 0, 23)
+        self.run_on_start = run_on_start
+        self.task: asyncio.Task = None
+
+    def matches(self, moment: datetime) -> bool:
+        return moment.minute in self.minutes and moment.hour in self.hours
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+
+class Scheduler:
+    """
+    Запускает задачи по расписанию в одном event loop.
+    Новый запуск задачи пропускается, пока ещё выполняется предыдущий запуск
+    этой задачи или другой задачи из той же группы.
+    """
+
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self._stopped = asyncio.Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    def start_job(self, job: CronJob):
+        if job.running:
+            logging.warning(f"Задача {job.name} ещё выполняется, пропускаем запуск")
+            return
+        busy = [other.name for other in self.jobs if other.running and job.group and other.group == job.group]
+        if busy:
+            logging.warning(f"Выполняется задача {busy[0]} из группы {job.group}, пропускаем запуск {job.name}")
+            return
+        job.task = asyncio.create_task(self._run_job(job))
+
+    async def _run_job(self, job: CronJob):
+        logging.info(f"Запуск задачи {job.name}")
+        started = time.monotonic()
+        try:
+            await job.func()
+            logging.info(f"Задача {job.name} завершена за {time.monotonic() - started:.1f} сек")
+        except Exception as e:
+            logging.error(f"Ошибка в задаче {job.name}: {e}\n{traceback.format_exc()}")
+
+    async def run(self):
+        for job in self.jobs:
+            if job.run_on_start:
+                self.start_job(job)
+
+        while not self._stopped.is_set():
+            # Спим до начала следующей минуты
+            now = datetime.now()
+            next_minute = now.replace(second=0, microsecond=0) + timedelta(minutes=1)
+            try:
+                await asyncio.wait_for(self._stopped.wait(), (next_minute - now).total_seconds())
+                break
+            except asyncio.TimeoutError:
+                pass
+
+            for job in self.jobs:
+                if job.matches(next_minute):
+                    self.start_job(job)
+
+        # Даём выполняющимся задачам завершиться
+        running = [job.task for job in self.jobs if job.running]
+        if running:
+            logging.info(f"Ожидаем завершения {len(running)} задач...")
+            await asyncio.gather(*running, return_exceptions=True)
+
+
+async def main():
+    await init_db_pool(DATABASE_URL)
+    if not await init_redis():
+        logging.error("Не удалось подключиться к Redis. Планировщик не запущен.")
+        return
+    await init_wakatime_client()
+    # Метрики задач обновления кэша отдаются самим планировщиком
+    await init_metrics_server()
+
+    scheduler = Scheduler([
+        # Месячная статистика — каждый час, кроме 00:00
+        CronJob(
+            "update_month_cache", lambda: update_month_cache(jitter=REFRESH_JITTER),
+            minute="0", hour="1-23", group="refresh",
+        ),
+        # В 00:00 и при старте месячная и годовая статистика обновляются за один проход.
+        # Задачи одной группы не пересекаются: если полное обновление идёт дольше часа,
+        # месячное в 01:00 пропускается — месяц и так обновится полным проходом
+        CronJob(
+            "update_caches", lambda: update_caches(jitter=REFRESH_JITTER),
+            minute="0", hour="0", run_on_start=True, group="refresh",
+        ),
+    ])
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, scheduler.stop)
+
+    logging.info("Планировщик обновления кэша запущен")
+    try:
+        await scheduler.run()
+    finally:
+        await close_metrics_server()
+        await close_key_health()
+        await close_wakatime_client()
+        await close_redis()
+        await close_db_pool()
+        logging.info("Планировщик остановлен")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,86 @@
+"""
+Объединение одновременных запросов на построение одного и того же лидерборда.
+"""
+import asyncio
+import logging
+import time
+
+from config import LEADERBOARD_RESULT_TTL
+
+
+class SingleFlight:
+    """
+    Выполняет не более одного построения на ключ одновременно.
+
+    Вызывающие, пришедшие во время построения, ждут тот же результат.
+    Успешный результат дополнительно хранится в памяти ttl секунд,
+    чтобы серии одинаковых команд обслуживались без повторного сбора.
+    """
+
+    def __init__(self, ttl: float = 0):
+        self.ttl = ttl
+        self._inflight = {}
+        self._results = {}
+
+    def get_cached(self, key):
+        """Возвращает свежий результат из памяти или None."""
+        cached = self._results.get(key)
+        if cached is None:
+            return None
+        expires_at, value = cached
+        if expires_at < time.monotonic():
+            del self._results[key]
+            return None
+        return value
+
+    def in_flight(self, key) -> bool:
+        return key in self._inflight
+
+    def forget(self, key):
+        """Удаляет результат из памяти, следующий вызов выполнит построение заново."""
+        self._results.pop(key, None)
+
+    async def do(self, key, fn):
+        """
+        Возвращает результат fn() для ключа, выполняя fn не более одного раза одновременно.
+
+        Args:
+            key: Хешируемый ключ, например ("day", date)
+            fn: Функция без аргументов, возвращающая корутину построения
+        """
+        cached = self.get_cached(key)
+        if cached is not None:
+            return cached
+
+        # shield: отмена одного ожидающего не должна отменять общее построение
+        return await asyncio.shield(self.start(key, fn))
+
+    def start(self, key, fn) -> asyncio.Future:
+        """
+        Запускает построение в фоне, если для ключа оно ещё не выполняется,
+        и возвращает задачу построения. Ошибка фоновой задачи только логируется.
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._on_done(key, t))
+        return task
+
+    def _on_done(self, key, task):
+        self._inflight.pop(key, None)
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            logging.error(f"Ошибка построения {key}: {task.exception()}")
+            return
+        if self.ttl > 0:
+            self._results[key] = (time.monotonic() + self.ttl, task.result())
+        # Устаревшие записи других ключей удаляем, чтобы словарь не рос
+        now = time.monotonic()
+        for stale_key in [k for k, (expires_at, _) in self._results.items() if expires_at < now]:
+            del self._results[stale_key]
+
+
+# Общий экземпляр для лидербордов, ключ — (период, дата)
+leaderboard_flight = SingleFlight(LEADERBOARD_RESULT_TTL)
@@ -0,0 +1,91 @@
+"""
+Потоковый разбор ответов WakaTime /summaries.
+
+Годовой ответ содержит за каждый из 365 дней детализацию по проектам,
+языкам, редакторам, ОС и машинам, а лидербордам нужен только
+grand_total.total_seconds. С установленным ijson тело читается из сокета
+кусками по CHUNK_SIZE, и из событий парсера берутся лишь нужные поля:
+полный словарь ответа не строится, пик памяти не зависит от детализации.
+ijson сам выбирает самый быстрый доступный бэкенд (yajl2_c, если собран).
+
+Без ijson тело читается целиком и разбирается orjson, если он установлен,
+иначе стандартным json.
+"""
+import json
+from datetime import date, datetime, timedelta
+
+try:
+    import ijson
+except ImportError:  # ijson — необязательная зависимость
+    ijson = None
+
+try:
+    import orjson
+except ImportError:  # orjson — необязательная зависимость
+    orjson = None
+
+CHUNK_SIZE = 64 * 1024
+
+_DAY = "data.item"
+_DATE = "data.item.range.date"
+_TOTAL = "data.item.grand_total.total_seconds"
+
+
+def loads(body):
+    """Разбирает JSON самым быстрым доступным бэкендом."""
+    return orjson.loads(body) if orjson is not None else json.loads(body)
+
+
+async def parse_summaries_stream(reader, start: date, breakdowns=()):
+    """
+    Разбирает ответ /summaries по мере чтения, не загружая его целиком.
+
+    Args:
+        reader: Поток с корутиной read(n), например resp.content из aiohttp
+        start: Первый день диапазона — для дней без range.date
+        breakdowns: Детализации, которые нужно собрать, например ("projects", "languages")
+
+    Returns:
+        Список кортежей (день, секунды), а если заданы breakdowns —
+        (день, секунды, {детализация: {имя: секунды}})
+
+    Raises:
+        ValueError: если ответ не является корректным ответом /summaries
+    """
+    if ijson is None:
+        raise RuntimeError("Для потокового разбора нужен пакет ijson")
+
+    # Префиксы событий имени и времени для каждой запрошенной детализации
+    names = {f"{_DAY}.{kind}.item.name": kind for kind in breakdowns}
+    totals = {f"{_DAY}.{kind}.item.total_seconds": kind for kind in breakdowns}
+
+    series = []
+    has_data = False
+    day_str, seconds, details, name = None, 0.0, None, None
+    try:
+        async for prefix, event, value in ijson.parse_async(reader, buf_size=CHUNK_SIZE, use_float=True):
+            if prefix == _DAY:
+                if event == "start_map":
+                    day_str, seconds, name = None, 0.0, None
+                    details = {kind: {} for kind in breakdowns}
+                elif event == "end_map":
+                    offset = len(series)
+                    day = datetime.strptime(day_str, "%Y-%m-%d").date() if day_str else start + timedelta(days=offset)
+                    series.append((day, seconds, details) if breakdowns else (day, seconds))
+            elif prefix == _DATE:
+                day_str = value
+            elif prefix == _TOTAL:
+                seconds = float(value or 0)
+            elif prefix == "data" and event == "start_array":
+                has_data = True
+            elif breakdowns:
+                if prefix in names:
+                    name = value
+                elif prefix in totals:
+                    kind = totals[prefix]
+                    details[kind][name] = details[kind].get(name, 0.0) + float(value or 0)
+    except ijson.JSONError as e:
+        raise ValueError(f"некорректный JSON: {e}")
+    if not has_data:
+        raise ValueError("в ответе нет массива data")
+    return series
@@ -0,0 +1,44 @@
+"""
+Проверки учёта ошибок авторизации WakaTime ключей (key_health.record_key_results).
+
+Запуск: python -m unittest discover tests
+"""
+import unittest
+from unittest import mock
+
+import key_health
+
+
+class RecordKeyResultsTest(unittest.IsolatedAsyncioTestCase):
+    async def test_fresh_process_resets_failures_from_db(self):
+        # Новый процесс (планировщик, воркер) ничего не знает об ошибках ключа,
+        # накопленных раньше: успех всё равно должен сбросить счётчик в БД
+        with mock.patch.object(key_health.db, "reset_key_failures", mock.AsyncMock(return_value=1)) as reset, \
+                mock.patch.object(key_health.db, "record_key_failures", mock.AsyncMock()) as record:
+            await key_health.record_key_results(["key-a", "key-b"], [])
+
+        reset.assert_awaited_once_with(["key-a", "key-b"])
+        record.assert_not_awaited()
+
+    async def test_failure_after_reset_starts_a_new_series(self):
+        with mock.patch.object(key_health.db, "reset_key_failures", mock.AsyncMock(return_value=0)) as reset, \
+                mock.patch.object(key_health.db, "record_key_failures",
+                                  mock.AsyncMock(return_value=[(1, 1, None)])) as record, \
+                mock.patch.object(key_health, "_notify_owner", mock.AsyncMock()) as notify:
+            await key_health.record_key_results([], ["key-a"])
+
+        reset.assert_not_awaited()
+        record.assert_awaited_once()
+        notify.assert_not_awaited()
+
+    async def test_owner_notified_when_threshold_reached(self):
+        rows = [(1, key_health.KEY_QUARANTINE_FAILURES, mock.MagicMock())]
+        with mock.patch.object(key_health.db, "record_key_failures", mock.AsyncMock(return_value=rows)), \
+                mock.patch.object(key_health, "_notify_owner", mock.AsyncMock()) as notify:
+            await key_health.record_key_results([], ["key-a"])
+
+        notify.assert_awaited_once_with(1, rows[0][2])
+
+
+if __name__ == "__main__":
+    unittest.main()
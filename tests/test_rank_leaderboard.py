@@ -0,0 +1,39 @@
+"""
+Проверки ранжирования лидерборда в памяти (utils.rank_leaderboard) и подписи пользователей без username.
+
+Запуск: python -m unittest discover tests
+"""
+import unittest
+
+from utils import format_username, rank_leaderboard
+
+
+class RankLeaderboardTest(unittest.TestCase):
+    def test_caller_found_by_telegram_id(self):
+        # Двое без username и двое с одинаковым username: автор команды — только один из них
+        entries = [
+            (1, None, 300),
+            (2, "dup", 200),
+            (3, None, 100),
+            (4, "dup", 50),
+        ]
+        top, around, total = rank_leaderboard(entries, 3, top_n=1, radius=0)
+
+        self.assertEqual(top, [(1, None, 300)])
+        self.assertEqual(around, [(3, None, 100)])
+        self.assertEqual(total, 4)
+
+        _, around, _ = rank_leaderboard(entries, 4, top_n=1, radius=1)
+        self.assertEqual(around, [(3, None, 100), (4, "dup", 50)])
+
+    def test_unknown_caller_has_no_neighbours(self):
+        _, around, _ = rank_leaderboard([(1, "a", 10)], 99, top_n=5, radius=2)
+        self.assertEqual(around, [])
+
+    def test_username_without_link_when_missing(self):
+        self.assertNotIn("href", format_username(None))
+        self.assertIn('href="https://t.me/alice"', format_username("alice"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -7,8 +7,11 @@ import asyncio
 import logging
 import sys
 
-from update_month_cache import update_month_cache
-from update_year_cache import update_year_cache
+from update_caches import update_caches
+from redis_cache import close_redis
+from wakatime_client import close_wakatime_client
+from key_health import close_key_health
+from db import close_db_pool
 
 # Настройка логирования
 logging.basicConfig(
@@ -20,22 +23,19 @@ logging.basicConfig(
 )
 
 async def update_all_caches():
-    """Обновляет все кэши статистики один за другим"""
+    """Обновляет месячный и годовой кэши статистики за один проход"""
     
-    logging.info("====== ОБНОВЛЕНИЕ МЕСЯЧНОЙ СТАТИСТИКИ ======")
+    logging.info("====== ОБНОВЛЕНИЕ МЕСЯЧНОЙ И ГОДОВОЙ СТАТИСТИКИ ======")
     try:
-        await update_month_cache()
-        logging.info("Обновление месячной статистики завершено успешно")
+        await update_caches()
+        logging.info("Обновление статистики завершено успешно")
     except Exception as e:
-        logging.error(f"Ошибка при обновлении месячной статистики: {e}")
-    
-    logging.info("\n====== ОБНОВЛЕНИЕ ГОДОВОЙ СТАТИСТИКИ ======")
-    try:
-        await update_year_cache()
-        logging.info("Обновление годовой статистики завершено успешно")
-    except Exception as e:
-        logging.error(f"Ошибка при обновлении годовой статистики: {e}")
+        logging.error(f"Ошибка при обновлении статистики: {e}")
     
+    await close_key_health()
+    await close_wakatime_client()
+    await close_redis()
+    await close_db_pool()
     logging.info("\n====== ОБНОВЛЕНИЕ КЭША ЗАВЕРШЕНО ======")
 
 if __name__ == "__main__":
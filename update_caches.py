@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Обновление кэшей статистики за несколько периодов за один проход.
+
+Свежие дни каждого пользователя загружаются в daily_totals один раз,
+после чего лидерборды всех периодов считаются по одному и тому же
+посуточному ряду. Планировщик запускает так обновление в 00:00,
+когда нужны и месячный, и годовой кэш.
+"""
+import asyncio
+import logging
+import os
+import sys
+import traceback
+
+from db import init_db_pool, close_db_pool, get_users_with_key
+from wakatime_client import PERIOD_DAYS, init_wakatime_client, close_wakatime_client
+from daily_totals import period_entries
+from refresh_queue import refresh_ingest
+from collector import is_cacheable
+from redis_cache import save_month_stats, save_year_stats, init_redis, close_redis
+from config import DATABASE_URL
+from key_health import close_key_health
+from metrics import RefreshRun
+
+# Настройка логирования
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.StreamHandler(sys.stdout)
+    ]
+)
+
+# Периоды, для которых есть кэш лидерборда в Redis
+CACHE_SAVERS = {
+    "month": save_month_stats,
+    "year": save_year_stats,
+}
+
+PERIOD_TITLES = {
+    "month": "месяц",
+    "year": "год",
+}
+
+
+async def update_caches(periods=("month", "year"), jitter: float = 0, job: str = "update_caches"):
+    """
+    Собирает статистику и обновляет кэши указанных периодов за один проход.
+
+    Подключения к БД, Redis и WakaTime переиспользуются, если уже открыты,
+    поэтому функцию можно вызывать из долгоживущего планировщика.
+    Длительность и число пользователей запуска попадают в метрики с меткой job.
+
+    Args:
+        periods: Периоды из CACHE_SAVERS, например ("month", "year")
+        jitter: Максимальная случайная задержка (сек) перед запросом каждого пользователя,
+            чтобы запросы к WakaTime распределялись во времени
+        job: Имя задачи для логов и метрик
+    """
+    run = RefreshRun(job)
+    try:
+        await _update_caches(periods, jitter, run)
+    finally:
+        run.observe()
+
+
+async def _update_caches(periods, jitter: float, run: RefreshRun):
+    names = ", ".join(periods)
+    logging.info(f"Начинаем обновление статистики ({names})...")
+
+    # Инициализируем подключение к базе данных
+    try:
+        await init_db_pool(DATABASE_URL)
+        logging.info("Подключение к базе данных установлено")
+    except Exception as e:
+        logging.error(f"Ошибка подключения к базе данных: {e}\n{traceback.format_exc()}")
+        return
+
+    # Проверяем подключение к Redis
+    if not await init_redis():
+        logging.error("Не удалось подключиться к Redis. Отмена обновления кэша.")
+        return
+
+    # Получаем список пользователей с ключом, ключи на карантине пропускаются
+    try:
+        users = await get_users_with_key()
+        if not users:
+            logging.warning("Не найдено пользователей для обновления статистики")
+            return
+    except Exception as e:
+        logging.error(f"Ошибка получения списка пользователей: {e}\n{traceback.format_exc()}")
+        return
+
+    # Собираем статистику
+    logging.info(f"Начинаем сбор статистики ({names}) для {len(users)} пользователей")
+    await init_wakatime_client()
+    # Свежие дни догружаются один раз для всех периодов, локально или воркерами
+    # (REFRESH_DISTRIBUTED); метка самого длинного периода — для метрик запросов
+    widest = max(periods, key=PERIOD_DAYS.get)
+    ingested, failed = await refresh_ingest(users, widest, jitter=jitter)
+    run.total = sum(1 for _, _, waka_key in users if waka_key)
+    run.failed = len(failed)
+
+    # Не кэшируем результат, если заметная часть запросов к WakaTime не удалась
+    if not is_cacheable(ingested, len(failed)):
+        logging.error(f"Не удалось получить данные для {len(failed)} пользователей, кэш не обновляется: {failed}")
+        return
+
+    # Итоги всех периодов считаются по уже сохранённым дням, без запросов к API
+    saved = []
+    for period in periods:
+        leaderboard = await period_entries(users, period)
+        if not leaderboard:
+            logging.warning(f"Нет данных за период {period} для сохранения в кэш")
+            continue
+        if await CACHE_SAVERS[period](leaderboard):
+            saved.append(period)
+            logging.info(f"Статистика за {PERIOD_TITLES[period]} обновлена для {len(leaderboard)} пользователей")
+        else:
+            logging.error(f"Не удалось сохранить статистику за {PERIOD_TITLES[period]} в кэш")
+    run.saved = len(saved) == len(periods)
+
+
+async def main():
+    try:
+        await update_caches()
+    finally:
+        await close_key_health()
+        await close_wakatime_client()
+        await close_redis()
+        await close_db_pool()
+
+if __name__ == "__main__":
+    try:
+        # Установим текущую директорию на директорию скрипта для правильной загрузки модулей
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        os.chdir(script_dir)
+
+        asyncio.run(main())
+        logging.info("Скрипт обновления кэшей завершен успешно")
+    except Exception as e:
+        logging.error(f"Ошибка при выполнении скрипта обновления кэшей: {e}\n{traceback.format_exc()}")
+        sys.exit(1)
@@ -0,0 +1,189 @@
+"""
+Реестр пользователей с WakaTime ключом в памяти процесса.
+
+Пользователи загружаются из БД один раз, а дальше реестр обновляется
+по уведомлениям Postgres (LISTEN/NOTIFY): триггеры на users и chat_members
+сообщают id изменённых строк, и реестр перечитывает только их. Поэтому
+команды лидербордов в установившемся режиме не обращаются к БД.
+
+Ключи на карантине (key_health.py) остаются в реестре вместе со сроком
+карантина и не выдаются, пока он не истёк.
+
+Пока соединение для LISTEN не установлено, реестр читает пользователей
+из БД при каждом запросе, чтобы не отдавать устаревшие данные.
+"""
+import asyncio
+import logging
+from datetime import datetime, timezone
+
+import asyncpg
+
+import db
+
+USERS_CHANNEL = "users_changed"
+CHAT_MEMBERS_CHANNEL = "chat_members_changed"
+
+# Пауза перед повторным подключением к LISTEN после обрыва
+RECONNECT_DELAY = 5
+
+
+class UserRegistry:
+    """
+    Пользователи с ключом и составы чатов, синхронизируемые через LISTEN/NOTIFY.
+    """
+
+    def __init__(self):
+        self.database_url = None
+        self.users = {}
+        self.chats = {}
+        self._conn: asyncpg.Connection = None
+        self._loaded = False
+        self._closed = False
+        self._tasks = set()
+
+    @property
+    def listening(self) -> bool:
+        return self._conn is not None and not self._conn.is_closed()
+
+    async def start(self, database_url: str):
+        """Подписывается на уведомления и загружает пользователей."""
+        self.database_url = database_url
+        self._closed = False
+        try:
+            await self._listen()
+        except Exception as e:
+            logging.error(f"Не удалось подписаться на изменения пользователей: {e}")
+            self._spawn(self._reconnect())
+
+    async def close(self):
+        self._closed = True
+        for task in list(self._tasks):
+            task.cancel()
+        if self.listening:
+            await self._conn.close()
+        self._conn = None
+        self._loaded = False
+
+    async def _listen(self):
+        conn = await asyncpg.connect(self.database_url)
+        await conn.add_listener(USERS_CHANNEL, self._on_users_notify)
+        await conn.add_listener(CHAT_MEMBERS_CHANNEL, self._on_chat_members_notify)
+        conn.add_termination_listener(self._on_terminated)
+        self._conn = conn
+        # Подписка раньше загрузки: изменения во время загрузки не теряются
+        await self._load()
+        logging.info(f"Реестр пользователей загружен: {len(self.users)} с ключом")
+
+    async def _load(self):
+        rows = await db.get_key_users()
+        self.users = {}
+        for row in rows:
+            self._remember(row)
+        self.chats = {}
+        self._loaded = True
+
+    def _remember(self, row):
+        tg_id, username, waka_key, failures, quarantined_until = row
+        self.users[tg_id] = (username, waka_key, quarantined_until)
+
+    def _on_terminated(self, conn):
+        if self._closed:
+            return
+        logging.warning("Соединение LISTEN потеряно, реестр пользователей читается из БД до переподключения")
+        self._conn = None
+        self._loaded = False
+        self._spawn(self._reconnect())
+
+    async def _reconnect(self):
+        while not self._closed and not self.listening:
+            await asyncio.sleep(RECONNECT_DELAY)
+            try:
+                await self._listen()
+            except Exception as e:
+                logging.error(f"Повторная подписка на изменения пользователей не удалась: {e}")
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _on_users_notify(self, conn, pid, channel, payload):
+        self._spawn(self._reload_user(int(payload)))
+
+    async def _reload_user(self, telegram_id: int):
+        try:
+            row = await db.get_user(telegram_id)
+        except Exception as e:
+            # Без актуальной строки реестр мог бы разойтись с БД: перечитываем целиком
+            logging.error(f"Не удалось перечитать пользователя {telegram_id}: {e}")
+            self._loaded = False
+            return
+        if row is not None and row[2]:
+            self._remember(row)
+        else:
+            self.users.pop(telegram_id, None)
+
+    def _on_chat_members_notify(self, conn, pid, channel, payload):
+        op, chat_id, telegram_id = payload.split(":")
+        members = self.chats.get(int(chat_id))
+        # Составы чатов, которые ещё не запрашивались, загрузятся при первом обращении
+        if members is None:
+            return
+        if op == "DELETE":
+            members.discard(int(telegram_id))
+        else:
+            members.add(int(telegram_id))
+
+    def _active(self, tg_ids):
+        now = datetime.now(timezone.utc)
+        users = []
+        for tg_id in tg_ids:
+            user = self.users.get(tg_id)
+            if user is None:
+                continue
+            username, waka_key, quarantined_until = user
+            if quarantined_until is None or quarantined_until <= now:
+                users.append((tg_id, username, waka_key))
+        return users
+
+    async def get_users(self):
+        """
+        Возвращает список кортежей (telegram_id, username, wakatime_key) пользователей
+        с ключом, кроме ключей на карантине.
+        """
+        if not self.listening:
+            return await db.get_users_with_key()
+        if not self._loaded:
+            await self._load()
+        return self._active(self.users)
+
+    async def get_chat_users(self, chat_id: int):
+        """
+        Возвращает пользователей с ключом среди участников чата.
+        Состав чата читается из БД при первом обращении, дальше обновляется по уведомлениям.
+        """
+        if not self.listening:
+            return [user for user in await db.get_chat_users(chat_id) if user[2]]
+        if not self._loaded:
+            await self._load()
+        members = self.chats.get(chat_id)
+        if members is None:
+            members = self.chats[chat_id] = await db.get_chat_member_ids(chat_id)
+        return self._active(members)
+
+    async def get_leaderboard_users(self, chat_id: int = None):
+        """Пользователи для лидерборда: участники чата или все, если chat_id = None."""
+        if chat_id is None:
+            return await self.get_users()
+        return await self.get_chat_users(chat_id)
+
+
+user_registry = UserRegistry()
+
+
+async def init_user_registry(database_url: str):
+    await user_registry.start(database_url)
+
+
+async def close_user_registry():
+    await user_registry.close()
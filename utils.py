@@ -1,6 +1,7 @@
 """
 Вспомогательные функции, используемые в разных обработчиках бота.
 """
+from datetime import datetime, timezone
 
 def format_time(minutes):
     """
@@ -36,9 +37,139 @@ def format_username(username):
     чтобы избежать упоминаний и уведомлений.
     
     Args:
-        username (str): имя пользователя Telegram
+        username (str): имя пользователя Telegram или None, если его нет
         
     Returns:
-        str: HTML-ссылка на профиль пользователя
+        str: HTML-ссылка на профиль пользователя или просто подпись без ссылки
     """
-    return f'<a href="https://t.me/{username}">{username}</a>' 
\ No newline at end of file
+    if not username:
+        return "<i>без username</i>"
+    return f'<a href="https://t.me/{username}">{username}</a>' 
+
+def format_failed_note(failed):
+    """
+    Формирует примечание о пользователях, чьи данные не удалось получить из WakaTime,
+    чтобы их отсутствие или неполное время не выглядело как 0 минут.
+
+    Args:
+        failed (list): список username с ошибкой запроса
+
+    Returns:
+        str: строка примечания или пустая строка
+    """
+    if not failed:
+        return ""
+    names = ", ".join(format_username(username) for username in failed)
+    return f"\n<i>Не удалось получить данные WakaTime для: {names}</i>"
+
+
+def rank_leaderboard(entries, telegram_id, top_n, radius):
+    """
+    Ранжирует лидерборд в памяти так же, как это делает sorted set в Redis.
+    Пользователь ищется по telegram_id: username может отсутствовать,
+    повторяться или смениться.
+
+    Args:
+        entries (list): список кортежей (telegram_id, username, minutes)
+        telegram_id (int): пользователь, для которого нужны соседние места
+        top_n (int): сколько первых мест вернуть
+        radius (int): сколько мест выше и ниже пользователя вернуть
+
+    Returns:
+        tuple: (top, around, total) — списки кортежей (rank, username, minutes)
+        и общее число участников
+    """
+    ordered = sorted(entries, key=lambda x: x[2], reverse=True)
+    ranked = [(rank, name, minutes) for rank, (_, name, minutes) in enumerate(ordered, start=1)]
+    around = []
+    for index, (tg_id, _, _) in enumerate(ordered):
+        if tg_id == telegram_id:
+            around = ranked[max(0, index - radius):index + radius + 1]
+            break
+    return ranked[:top_n], around, len(ranked)
+
+
+def format_ranked_lines(title, top, around, total):
+    """
+    Формирует строки лидерборда: первые места и, если пользователь
+    в них не попал, его место вместе с соседями.
+
+    Args:
+        title (str): заголовок
+        top (list): первые места, кортежи (rank, username, minutes)
+        around (list): места вокруг пользователя, кортежи (rank, username, minutes)
+        total (int): общее число участников
+
+    Returns:
+        list: строки сообщения
+    """
+    lines = [title]
+    for rank, username, minutes in top:
+        lines.append(f"{rank}. {format_username(username)} — {format_time(minutes)}")
+
+    top_ranks = {rank for rank, _, _ in top}
+    extra = [entry for entry in around if entry[0] not in top_ranks]
+    if extra:
+        lines.append("…")
+        for rank, username, minutes in extra:
+            lines.append(f"{rank}. {format_username(username)} — {format_time(minutes)}")
+
+    if total > len(top):
+        lines.append(f"\nВсего участников: {total}")
+    return lines
+
+
+# Аргументы команды, запрашивающие общий лидерборд вместо лидерборда чата
+GLOBAL_SCOPE_ARGS = {"all", "global", "все"}
+
+
+def leaderboard_chat_id(message, args):
+    """
+    Определяет, по участникам какого чата строить лидерборд.
+
+    Args:
+        message: сообщение с командой
+        args (str): аргументы команды
+
+    Returns:
+        int или None: id группы или None для общего лидерборда
+        (в личных сообщениях и с аргументом all)
+    """
+    if message.chat.type == "private":
+        return None
+    if args and args.strip().lower() in GLOBAL_SCOPE_ARGS:
+        return None
+    return message.chat.id
+
+
+def format_scope_note(chat_id, command):
+    """
+    Формирует примечание о том, что лидерборд построен только по участникам чата.
+
+    Args:
+        chat_id (int): id чата или None для общего лидерборда
+        command (str): имя команды без слэша
+
+    Returns:
+        str: строка примечания или пустая строка
+    """
+    if chat_id is None:
+        return ""
+    return f"\n<i>Только участники этого чата. Общий топ: /{command} all</i>"
+
+
+def format_degraded_note(updated_at):
+    """
+    Формирует примечание о том, что WakaTime недоступен и показаны последние
+    известные данные, с указанием их возраста.
+
+    Args:
+        updated_at (datetime): момент обновления данных (с часовым поясом) или None
+
+    Returns:
+        str: строка примечания
+    """
+    if updated_at is None:
+        return "\n<i>WakaTime сейчас недоступен, сохранённых данных пока нет</i>"
+    age_minutes = max(0.0, (datetime.now(timezone.utc) - updated_at).total_seconds() / 60)
+    return f"\n<i>WakaTime сейчас недоступен: показаны данные {format_time(age_minutes)} назад</i>"
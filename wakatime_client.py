@@ -1,175 +1,423 @@
 import aiohttp
+import asyncio
 import logging
-from datetime import datetime, timedelta
+import random
+import time
+from datetime import date, datetime, timedelta
+from typing import Optional
 
+from config import (
+    WAKATIME_API_URL,
+    WAKATIME_POOL_LIMIT,
+    WAKATIME_POOL_LIMIT_PER_HOST,
+    WAKATIME_KEEPALIVE_TIMEOUT,
+    WAKATIME_DNS_CACHE_TTL,
+    WAKATIME_REQUEST_TIMEOUT,
+    WAKATIME_MAX_RETRIES,
+    WAKATIME_BACKOFF_BASE,
+    WAKATIME_BACKOFF_MAX,
+    WAKATIME_TODAY_STRATEGY,
+    WAKATIME_STREAM_PARSE,
+)
+from circuit_breaker import waka_breaker
+from metrics import WAKATIME_REQUEST_SECONDS
+from rate_limit import waka_limiter
+from result_cache import result_cache
+import summaries_stream
 
-async def get_coding_time_today(waka_key: str) -> float:
+
+class WakaTimeError(Exception):
     """
-    Запрашивает у WakaTime суммарное время (в минутах) кодирования
-    за сегодняшний день. Учитывает все категории.
+    Запрос к WakaTime не удался. В отличие от 0 минут, означает, что данных нет.
 
-    Аутентификация осуществляется посредством передачи API ключа в параметре запроса.
+    status — HTTP статус последней попытки (None при сетевой ошибке).
     """
-    today = datetime.now().strftime("%Y-%m-%d")
-    url = "https://wakatime.com/api/v1/users/current/summaries"
-    params = {"start": today, "end": today, "api_key": waka_key}
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url, params=params) as resp:
-            if resp.status != 200:
-                logging.error(f"Ошибка запроса к WakaTime API: статус {resp.status}")
-                return 0.0
-            data = await resp.json()
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class CircuitOpenError(WakaTimeError):
+    """Запрос не выполнялся: предохранитель WakaTime разомкнут."""
+
+
+# Статусы WakaTime, означающие, что API ключ не принят
+AUTH_ERROR_STATUSES = {401, 403}
 
-    # Если данных нет или структура ответа не соответствует ожидаемой
-    if not data.get("data") or not isinstance(data["data"], list) or not data["data"]:
-        logging.warning(f"Пустой или некорректный ответ от WakaTime API")
-        return 0.0
 
-    # Берём суммарное время (grand_total) вместо фильтрации по категориям
+def _retry_after(resp) -> Optional[float]:
+    """
+    Читает заголовок Retry-After в секундах, если он задан числом.
+    Значение ограничено WAKATIME_BACKOFF_MAX, чтобы большой Retry-After
+    не останавливал запрос (и блокировку ключа в ограничителе) надолго.
+    """
+    value = resp.headers.get("Retry-After")
     try:
-        day_data = data["data"][0]  # Данные за текущий день
-        total_seconds = day_data.get("grand_total", {}).get("total_seconds", 0)
-        
-        # Выводим детальную информацию для отладки
-        logging.info(f"WakaTime API ответ: {total_seconds} секунд за сегодня")
-        
-        return total_seconds / 60.0
-    except (KeyError, IndexError, TypeError) as e:
-        logging.error(f"Ошибка при обработке ответа WakaTime API: {e}")
-        return 0.0
+        return min(WAKATIME_BACKOFF_MAX, max(0.0, float(value))) if value else None
+    except ValueError:
+        return None
 
 
-async def get_coding_time_week(waka_key: str) -> float:
+def _backoff_delay(attempt: int) -> float:
+    """Экспоненциальная задержка с полным случайным разбросом."""
+    return random.uniform(0, min(WAKATIME_BACKOFF_MAX, WAKATIME_BACKOFF_BASE * 2 ** attempt))
+
+
+class WakaTimeClient:
     """
-    Запрашивает у WakaTime суммарное время (в минутах) кодирования
-    за последние 7 дней (включая сегодняшний день). Учитывает все категории.
+    Долгоживущий HTTP-клиент WakaTime с общим пулом соединений.
 
-    :param waka_key: API ключ пользователя.
-    :return: Общее количество минут кодинга за неделю.
+    Одна aiohttp.ClientSession переиспользуется всеми запросами процесса,
+    поэтому TCP/TLS рукопожатие с wakatime.com выполняется один раз
+    на соединение, а не на каждый запрос.
     """
-    end_date = datetime.now()
-    start_date = end_date - timedelta(days=6)  # 7 дней: сегодня + 6 предыдущих
-    url = "https://wakatime.com/api/v1/users/current/summaries"
-    params = {
-        "start": start_date.strftime("%Y-%m-%d"),
-        "end": end_date.strftime("%Y-%m-%d"),
-        "api_key": waka_key
-    }
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url, params=params) as resp:
-            if resp.status != 200:
-                logging.error(f"Ошибка запроса к WakaTime API за неделю: статус {resp.status}")
-                return 0.0
-            data = await resp.json()
+    def __init__(self):
+        self._session: aiohttp.ClientSession = None
 
-    # Если данных нет или структура ответа не соответствует ожидаемой
-    if not data.get("data") or not isinstance(data["data"], list):
-        logging.warning(f"Пустой или некорректный ответ от WakaTime API")
-        return 0.0
+    async def start(self):
+        """Создаёт сессию с настроенным коннектором, если она ещё не создана."""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=WAKATIME_POOL_LIMIT,
+                limit_per_host=WAKATIME_POOL_LIMIT_PER_HOST,
+                keepalive_timeout=WAKATIME_KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=WAKATIME_DNS_CACHE_TTL,
+                use_dns_cache=True,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=WAKATIME_REQUEST_TIMEOUT),
+            )
+            logging.info("HTTP-сессия WakaTime создана")
 
-    # Суммируем grand_total.total_seconds за все дни недели
-    total_seconds = 0
-    try:
-        # Итерируемся по дням недели в ответе
-        for day_data in data["data"]:
-            total_seconds += day_data.get("grand_total", {}).get("total_seconds", 0)
-        
-        # Выводим детальную информацию для отладки
-        logging.info(f"WakaTime API ответ: {total_seconds} секунд за неделю")
-        
-        return total_seconds / 60.0
-    except (KeyError, TypeError) as e:
-        logging.error(f"Ошибка при обработке ответа WakaTime API: {e}")
-        return 0.0
+    async def close(self):
+        """Закрывает сессию и все соединения пула."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logging.info("HTTP-сессия WakaTime закрыта")
+        self._session = None
 
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            raise RuntimeError("Клиент WakaTime не инициализирован, вызовите init_wakatime_client()")
+        return self._session
 
-async def get_coding_time_month(waka_key: str) -> float:
+    async def get_json(self, url: str, params: dict, waka_key: str, period: str = "other", read=None):
+        """
+        GET-запрос к WakaTime с ограничением частоты и повторными попытками.
+
+        При 429 и 5xx запрос повторяется до WAKATIME_MAX_RETRIES раз: задержка
+        берётся из Retry-After, а если его нет — экспоненциальная со случайным
+        разбросом. Остальные ошибки не повторяются. Длительность каждой попытки
+        попадает в метрику wakatime_request_seconds с метками period и status,
+        а исход — в предохранитель: при разомкнутом предохранителе запрос
+        отклоняется сразу.
+
+        :param read: Корутина read(resp) для разбора успешного ответа вместо resp.json().
+        :raises WakaTimeError: если данные получить не удалось.
+        """
+        status = None
+        for attempt in range(WAKATIME_MAX_RETRIES + 1):
+            await waka_limiter.acquire(waka_key)
+            if not await waka_breaker.acquire():
+                raise CircuitOpenError("WakaTime API недоступен, предохранитель разомкнут")
+            retry_after = None
+            started = time.perf_counter()
+            try:
+                async with self.session.get(url, params=params) as resp:
+                    status = resp.status
+                    if status == 200:
+                        if read:
+                            data = await read(resp)
+                        else:
+                            try:
+                                data = await resp.json(loads=summaries_stream.loads)
+                            except ValueError as e:
+                                # Ошибка декодирования json/orjson — тоже ошибка WakaTime, а не ValueError
+                                raise WakaTimeError(f"Ошибка при обработке ответа WakaTime API: {e}", status)
+                        waka_limiter.on_success()
+                        return data
+                    if status == 429:
+                        retry_after = _retry_after(resp)
+                        waka_limiter.on_throttled(waka_key, retry_after)
+                    elif status < 500:
+                        raise WakaTimeError(f"WakaTime API вернул статус {status}", status)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                status = None
+                logging.warning(f"Сетевая ошибка запроса к WakaTime API: {e!r}")
+            finally:
+                elapsed = time.perf_counter() - started
+                WAKATIME_REQUEST_SECONDS.labels(period, status or "error").observe(elapsed)
+                # 4xx и 429 означают, что API работает: предохранитель учитывает их как успех
+                waka_breaker.record(status is not None and status < 500, elapsed)
+
+            if attempt == WAKATIME_MAX_RETRIES:
+                break
+            delay = retry_after if retry_after is not None else _backoff_delay(attempt)
+            logging.warning(
+                f"WakaTime API: статус {status}, попытка {attempt + 1}, повтор через {delay:.1f} сек"
+            )
+            await asyncio.sleep(delay)
+
+        raise WakaTimeError(f"WakaTime API недоступен после {WAKATIME_MAX_RETRIES + 1} попыток (статус {status})", status)
+
+
+waka_client = WakaTimeClient()
+
+
+# Предупреждение об отсутствии ijson выводится один раз за процесс
+_stream_checked = False
+
+
+async def init_wakatime_client():
+    global _stream_checked
+
+    if not _stream_checked:
+        _stream_checked = True
+        if WAKATIME_STREAM_PARSE and summaries_stream.ijson is None:
+            logging.warning(
+                "WAKATIME_STREAM_PARSE включён, но пакет ijson не установлен: "
+                "ответы /summaries разбираются целиком в памяти"
+            )
+    await waka_client.start()
+
+
+async def close_wakatime_client():
+    await waka_client.close()
+
+
+SUMMARIES_URL = f"{WAKATIME_API_URL}/users/current/summaries"
+CURRENT_USER_URL = f"{WAKATIME_API_URL}/users/current"
+STATUS_BAR_TODAY_URL = f"{WAKATIME_API_URL}/users/current/status_bar/today"
+
+# Длина периодов в днях, включая сегодняшний день
+PERIOD_DAYS = {
+    "day": 1,
+    "week": 7,
+    "month": 30,
+    "year": 365,
+}
+
+
+def period_range(period: str, today: date = None):
     """
-    Запрашивает у WakaTime суммарное время (в минутах) кодирования
-    за последние 30 дней (включая сегодняшний день). Учитывает все категории.
+    Возвращает (start, end) — границы периода включительно, заканчивающегося сегодня.
+    """
+    end = today or datetime.now().date()
+    return end - timedelta(days=PERIOD_DAYS[period] - 1), end
+
+
+def sum_minutes(series, period: str, today: date = None) -> float:
+    """
+    Суммирует время кодинга (в минутах) из посуточного ряда за указанный период.
+
+    :param series: Список кортежей (день, секунды), как из fetch_daily_totals.
+    :param period: Один из ключей PERIOD_DAYS.
+    :return: Количество минут за период.
+    """
+    start, end = period_range(period, today)
+    return sum(seconds for day, seconds in series if start <= day <= end) / 60.0
+
+
+async def _request_daily_totals(waka_key: str, start: date, end: date, period: str):
+    """
+    Запрашивает у WakaTime посуточное суммарное время кодирования за диапазон дат.
+    Учитывает все категории (grand_total). Если установлен ijson, ответ
+    разбирается потоково (summaries_stream.py), без загрузки детализации в память.
 
     :param waka_key: API ключ пользователя.
-    :return: Общее количество минут кодинга за месяц.
+    :param start: Первый день диапазона (включительно).
+    :param end: Последний день диапазона (включительно).
+    :param period: Метка периода для метрик задержки запросов.
+    :return: Список кортежей (день, секунды) по возрастанию дат.
+    :raises WakaTimeError: при ошибке запроса или некорректном ответе,
+             чтобы отличать «0 минут» от «данные не получены».
     """
-    end_date = datetime.now()
-    start_date = end_date - timedelta(days=29)  # 30 дней: сегодня + 29 предыдущих
-    url = "https://wakatime.com/api/v1/users/current/summaries"
     params = {
-        "start": start_date.strftime("%Y-%m-%d"),
-        "end": end_date.strftime("%Y-%m-%d"),
-        "api_key": waka_key
+        "start": start.strftime("%Y-%m-%d"),
+        "end": end.strftime("%Y-%m-%d"),
+        "api_key": waka_key,
     }
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url, params=params) as resp:
-            if resp.status != 200:
-                logging.error(f"Ошибка запроса к WakaTime API за месяц: статус {resp.status}")
-                return 0.0
-            data = await resp.json()
+    if WAKATIME_STREAM_PARSE and summaries_stream.ijson is not None:
+        async def read(resp):
+            try:
+                return await summaries_stream.parse_summaries_stream(resp.content, start)
+            except ValueError as e:
+                raise WakaTimeError(f"Ошибка при обработке ответа WakaTime API: {e}")
+
+        series = await waka_client.get_json(SUMMARIES_URL, params, waka_key, period, read)
+    else:
+        data = await waka_client.get_json(SUMMARIES_URL, params, waka_key, period)
+        series = parse_summaries(data, start)
+    logging.info(f"WakaTime API ответ: {sum(s for _, s in series)} секунд за {len(series)} дн.")
+    return series
+
+
+def _parse_day(day_data, default_day: date):
+    day_str = (day_data.get("range") or {}).get("date")
+    day = datetime.strptime(day_str, "%Y-%m-%d").date() if day_str else default_day
+    seconds = (day_data.get("grand_total") or {}).get("total_seconds", 0) or 0
+    return day, float(seconds)
+
+
+def parse_summaries(data, start: date):
+    """
+    Извлекает посуточный ряд из ответа /summaries.
 
+    :return: Список кортежей (день, секунды).
+    :raises WakaTimeError: если структура ответа не соответствует ожидаемой.
+    """
     # Если данных нет или структура ответа не соответствует ожидаемой
-    if not data.get("data") or not isinstance(data["data"], list):
-        logging.warning(f"Пустой или некорректный ответ от WakaTime API")
-        return 0.0
+    if not isinstance(data, dict) or not isinstance(data.get("data"), list):
+        raise WakaTimeError("Некорректный ответ от WakaTime API")
+    try:
+        return [_parse_day(day_data, start + timedelta(days=offset)) for offset, day_data in enumerate(data["data"])]
+    except (KeyError, TypeError, ValueError, AttributeError) as e:
+        raise WakaTimeError(f"Ошибка при обработке ответа WakaTime API: {e}")
 
-    # Суммируем grand_total.total_seconds за все дни месяца
-    total_seconds = 0
+
+def parse_status_bar(data, today: date):
+    """
+    Извлекает итог дня из ответа /status_bar/today.
+
+    :return: Кортеж (день, секунды).
+    :raises WakaTimeError: если структура ответа не соответствует ожидаемой.
+    """
+    if not isinstance(data, dict) or not isinstance(data.get("data"), dict):
+        raise WakaTimeError("Некорректный ответ status_bar от WakaTime API")
     try:
-        # Итерируемся по дням месяца в ответе
-        for day_data in data["data"]:
-            total_seconds += day_data.get("grand_total", {}).get("total_seconds", 0)
-        
-        # Выводим детальную информацию для отладки
-        logging.info(f"WakaTime API ответ: {total_seconds} секунд за месяц")
-        
-        return total_seconds / 60.0
-    except (KeyError, TypeError) as e:
-        logging.error(f"Ошибка при обработке ответа WakaTime API: {e}")
-        return 0.0
+        return _parse_day(data["data"], today)
+    except (KeyError, TypeError, ValueError, AttributeError) as e:
+        raise WakaTimeError(f"Ошибка при обработке ответа status_bar WakaTime API: {e}")
 
 
-async def get_coding_time_year(waka_key: str) -> float:
+async def _today_from_status_bar(waka_key: str, today: date, period: str):
+    data = await waka_client.get_json(STATUS_BAR_TODAY_URL, {"api_key": waka_key}, waka_key, period)
+    day, seconds = parse_status_bar(data, today)
+    # «Сегодня» WakaTime считает в часовом поясе пользователя: чужой день не подменяет наш
+    if day != today:
+        raise WakaTimeError(f"status_bar вернул итог за {day}, а не за {today}")
+    return [(day, seconds)]
+
+
+async def _today_from_summaries(waka_key: str, today: date, period: str):
+    return await _request_daily_totals(waka_key, today, today, period)
+
+
+# Способы получения итога за сегодня; summaries — запасной для всех остальных
+TODAY_STRATEGIES = {
+    "status_bar": _today_from_status_bar,
+    "summaries": _today_from_summaries,
+}
+
+
+async def request_today(waka_key: str, today: date, period: str = "day", strategy: str = None):
     """
-    Запрашивает у WakaTime суммарное время (в минутах) кодирования
-    за последние 365 дней (включая сегодняшний день). Учитывает все категории.
+    Запрашивает итог за сегодня способом strategy (по умолчанию WAKATIME_TODAY_STRATEGY).
+    Если лёгкий способ не сработал, итог запрашивается через /summaries;
+    при отклонённом ключе и разомкнутом предохранителе повтор бессмыслен.
 
-    :param waka_key: API ключ пользователя.
-    :return: Общее количество минут кодинга за год.
+    :return: Список из одного кортежа (день, секунды), как у _request_daily_totals.
     """
-    end_date = datetime.now()
-    start_date = end_date - timedelta(days=364)  # 365 дней: сегодня + 364 предыдущих
-    url = "https://wakatime.com/api/v1/users/current/summaries"
-    params = {
-        "start": start_date.strftime("%Y-%m-%d"),
-        "end": end_date.strftime("%Y-%m-%d"),
-        "api_key": waka_key
-    }
+    strategy = strategy or WAKATIME_TODAY_STRATEGY
+    fetch = TODAY_STRATEGIES.get(strategy, _today_from_summaries)
+    if fetch is not _today_from_summaries:
+        try:
+            return await fetch(waka_key, today, period)
+        except CircuitOpenError:
+            raise
+        except WakaTimeError as e:
+            if e.status in AUTH_ERROR_STATUSES:
+                raise
+            logging.warning(f"Итог за сегодня через {strategy} не получен ({e}), запрашиваем summaries")
+    return await _today_from_summaries(waka_key, today, period)
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url, params=params) as resp:
-            if resp.status != 200:
-                logging.error(f"Ошибка запроса к WakaTime API за год: статус {resp.status}")
-                return 0.0
-            data = await resp.json()
 
-    # Если данных нет или структура ответа не соответствует ожидаемой
-    if not data.get("data") or not isinstance(data["data"], list):
-        logging.warning(f"Пустой или некорректный ответ от WakaTime API")
-        return 0.0
+async def _request_range(waka_key: str, start: date, end: date, period: str):
+    """Запрос диапазона: только сегодняшний день берётся лёгким способом, остальное — из /summaries."""
+    today = datetime.now().date()
+    if start == end == today:
+        return await request_today(waka_key, today, period)
+    return await _request_daily_totals(waka_key, start, end, period)
+
+
+async def fetch_daily_totals(waka_key: str, start: date, end: date, period: str = "range"):
+    """
+    Возвращает посуточное суммарное время кодирования за диапазон дат.
+
+    Диапазоны из свежих дней (сегодня и вчера) берутся из кэша рядов
+    пользователей (память процесса и Redis), остальные запрашиваются
+    у WakaTime одним запросом. Диапазон из одного сегодняшнего дня
+    запрашивается через request_today.
+    Параметры и результат — как у _request_daily_totals.
+    """
+    series = await result_cache.get(waka_key, start, end, period)
+    if series is not None:
+        return series
+    series = await _request_range(waka_key, start, end, period)
+    await result_cache.put(waka_key, start, end, period, series)
+    return series
+
+
+async def fetch_period_series(waka_key: str, period: str):
+    """
+    Запрашивает посуточный ряд за период, заканчивающийся сегодня.
+    """
+    start, end = period_range(period)
+    return await fetch_daily_totals(waka_key, start, end, period)
+
 
-    # Суммируем grand_total.total_seconds за все дни года
-    total_seconds = 0
+async def prefetch_period_series(users, period: str):
+    """
+    Загружает из Redis закэшированные ряды всех пользователей за период
+    одним запросом перед параллельным сбором.
+    """
+    start, end = period_range(period)
+    await result_cache.prefetch([(waka_key, start, end) for _, _, waka_key in users], period)
+
+
+async def validate_key(waka_key: str):
+    """
+    Проверяет API ключ лёгким запросом профиля пользователя.
+
+    :return: True — ключ принят, False — WakaTime отклонил его (401/403),
+             None — проверить не удалось (сеть, 5xx, исчерпаны повторы).
+    """
     try:
-        # Итерируемся по дням года в ответе
-        for day_data in data["data"]:
-            total_seconds += day_data.get("grand_total", {}).get("total_seconds", 0)
-        
-        # Выводим детальную информацию для отладки
-        logging.info(f"WakaTime API ответ: {total_seconds} секунд за год")
-        
-        return total_seconds / 60.0
-    except (KeyError, TypeError) as e:
-        logging.error(f"Ошибка при обработке ответа WakaTime API: {e}")
-        return 0.0
\ No newline at end of file
+        await waka_client.get_json(CURRENT_USER_URL, {"api_key": waka_key}, waka_key, "validate")
+    except WakaTimeError as e:
+        return False if e.status in AUTH_ERROR_STATUSES else None
+    return True
+
+
+async def get_coding_time(waka_key: str, period: str) -> float:
+    """
+    Запрашивает у WakaTime суммарное время (в минутах) кодирования за период
+    (day, week, month или year), включая сегодняшний день.
+    """
+    series = await fetch_period_series(waka_key, period)
+    return sum_minutes(series, period)
+
+
+async def get_coding_time_today(waka_key: str) -> float:
+    """Время кодирования (в минутах) за сегодняшний день."""
+    return await get_coding_time(waka_key, "day")
+
+
+async def get_coding_time_week(waka_key: str) -> float:
+    """Время кодирования (в минутах) за последние 7 дней, включая сегодня."""
+    return await get_coding_time(waka_key, "week")
+
+
+async def get_coding_time_month(waka_key: str) -> float:
+    """Время кодирования (в минутах) за последние 30 дней, включая сегодня."""
+    return await get_coding_time(waka_key, "month")
+
+
+async def get_coding_time_year(waka_key: str) -> float:
+    """Время кодирования (в минутах) за последние 365 дней, включая сегодня."""
+    return await get_coding_time(waka_key, "year")
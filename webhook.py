@@ -0,0 +1,104 @@
+"""
+Режим webhook: Telegram сам присылает обновления на HTTP-сервер бота.
+
+Сервер aiohttp слушает WEBHOOK_PORT и отдаёт там же /metrics. Запросы
+без правильного X-Telegram-Bot-Api-Secret-Token отклоняются. Обновление
+обрабатывается в фоне, а Telegram сразу получает ответ 200, поэтому
+долгие команды не задерживают доставку следующих обновлений.
+
+Несколько реплик за балансировщиком регистрируют один и тот же URL;
+состояния FSM хранятся в Redis и общие для всех реплик.
+"""
+import asyncio
+import hmac
+import logging
+import signal
+
+from aiogram import Bot, Dispatcher
+from aiohttp import web
+
+from config import WEBHOOK_BASE_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_PORT
+from metrics import metrics_handler
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """
+    HTTP-сервер webhook для одного бота и диспетчера.
+
+    Задачи обработки обновлений хранятся до завершения, чтобы
+    при остановке дождаться уже принятых обновлений.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot):
+        self.dp = dp
+        self.bot = bot
+        self._tasks = set()
+
+    async def handle_update(self, request: web.Request):
+        token = request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(token, WEBHOOK_SECRET):
+            logging.warning(f"Отклонён запрос к webhook с неверным секретом от {request.remote}")
+            return web.Response(status=401)
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _process(self, update):
+        try:
+            await self.dp.feed_raw_update(self.bot, update)
+        except Exception as e:
+            logging.error(f"Ошибка обработки обновления {update.get('update_id')}: {e}")
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(WEBHOOK_PATH, self.handle_update)
+        # Метрики отдаются на том же порту, отдельный сервер метрик не нужен
+        app.router.add_get("/metrics", metrics_handler)
+        return app
+
+    async def wait_tasks(self):
+        if self._tasks:
+            logging.info(f"Ожидаем обработки {len(self._tasks)} обновлений...")
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    """
+    Регистрирует webhook в Telegram и обслуживает обновления до SIGTERM/SIGINT.
+    """
+    if not WEBHOOK_BASE_URL or not WEBHOOK_SECRET:
+        raise RuntimeError("Для режима webhook нужно задать WEBHOOK_BASE_URL и WEBHOOK_SECRET")
+
+    server = WebhookServer(dp, bot)
+    runner = web.AppRunner(server.create_app(), access_log=None)
+    await runner.setup()
+
+    stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopped.set)
+
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    try:
+        await web.TCPSite(runner, "0.0.0.0", WEBHOOK_PORT).start()
+        # Все реплики регистрируют один и тот же URL, повторная установка безопасна
+        await bot.set_webhook(
+            f"{WEBHOOK_BASE_URL}{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+        logging.info(f"Бот запущен в режиме webhook на порту {WEBHOOK_PORT}. Ожидаем обновлений...")
+        await stopped.wait()
+    finally:
+        # Webhook не удаляем: остальные реплики продолжают принимать обновления
+        await runner.cleanup()
+        await server.wait_tasks()
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)